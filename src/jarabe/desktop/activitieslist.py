@@ -178,12 +178,17 @@ class ListModel(gtk.TreeModelSort):
         for info in registry:
             self._add_activity(info)
         registry.connect('bundle-added', self.__activity_added_cb)
+        registry.connect('bundles-added', self.__activities_added_cb)
         registry.connect('bundle-changed', self.__activity_changed_cb)
         registry.connect('bundle-removed', self.__activity_removed_cb)
 
     def __activity_added_cb(self, activity_registry, activity_info):
         self._add_activity(activity_info)
 
+    def __activities_added_cb(self, activity_registry, activities_info):
+        for activity_info in activities_info:
+            self._add_activity(activity_info)
+
     def __activity_changed_cb(self, activity_registry, activity_info):
         bundle_id = activity_info.get_bundle_id()
         version = activity_info.get_activity_version()
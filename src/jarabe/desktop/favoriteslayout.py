@@ -335,7 +335,9 @@ class RingLayout(FavoritesLayout):
 
                 child.allocate(int(x), int(y), child_width, child_height,
                                origin_changed)
-                child.item.props.size = icon_size
+                # Setting the same size would render the icon again
+                if child.item.props.size != icon_size:
+                    child.item.props.size = icon_size
 
         for child in self._locked_children.keys():
             x, y = self._locked_children[child]
@@ -19,6 +19,7 @@ import logging
 from gettext import gettext as _
 import math
 
+import cairo
 import gobject
 import gconf
 import glib
@@ -38,6 +39,7 @@ from jarabe.view.palettes import JournalPalette
 from jarabe.view.palettes import CurrentActivityPalette, ActivityPalette
 from jarabe.view.buddyicon import BuddyIcon
 from jarabe.view.buddymenu import BuddyMenu
+from jarabe.view import iconcache
 from jarabe.model.buddy import get_owner_instance
 from jarabe.model import shell
 from jarabe.model import bundleregistry
@@ -135,6 +137,7 @@ class FavoritesView(hippo.Canvas):
                 self._add_activity(info)
 
         registry.connect('bundle-added', self.__activity_added_cb)
+        registry.connect('bundles-added', self.__activities_added_cb)
         registry.connect('bundle-removed', self.__activity_removed_cb)
         registry.connect('bundle-changed', self.__activity_changed_cb)
 
@@ -153,6 +156,10 @@ class FavoritesView(hippo.Canvas):
                 activity_info.get_activity_version()):
             self._add_activity(activity_info)
 
+    def __activities_added_cb(self, activity_registry, activities_info):
+        for activity_info in activities_info:
+            self.__activity_added_cb(activity_registry, activity_info)
+
     def _find_activity_icon(self, bundle_id, version):
         for icon in self._box.get_children():
             if isinstance(icon, ActivityIcon) and \
@@ -361,6 +368,50 @@ class FavoritesView(hippo.Canvas):
                 icon.set_resume_mode(self._resume_mode)
 
 
+# Most recently used first, as in jarabe.view.iconcache
+_border_surfaces = {}
+_border_keys = []
+
+
+def _get_border_surface(width, height):
+    """Return the hover border of an ActivityIcon of the given size"""
+    key = (width, height)
+    surface = _border_surfaces.get(key)
+    if surface is not None:
+        _border_keys.remove(key)
+        _border_keys.insert(0, key)
+        return surface
+
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    cr = cairo.Context(surface)
+
+    x = ActivityIcon._BORDER_WIDTH / 2.0
+    y = ActivityIcon._BORDER_WIDTH / 2.0
+    width -= ActivityIcon._BORDER_WIDTH
+    height -= ActivityIcon._BORDER_WIDTH
+    radius = width / 10.0
+
+    cr.move_to(x + radius, y)
+    cr.arc(x + width - radius, y + radius, radius, math.pi * 1.5,
+           math.pi * 2.0)
+    cr.arc(x + width - radius, x + height - radius, radius, 0,
+           math.pi * 0.5)
+    cr.arc(x + radius, y + height - radius, radius, math.pi * 0.5, math.pi)
+    cr.arc(x + radius, y + radius, radius, math.pi, math.pi * 1.5)
+
+    color = style.COLOR_SELECTION_GREY.get_int()
+    hippo.cairo_set_source_rgba32(cr, color)
+    cr.set_line_width(ActivityIcon._BORDER_WIDTH)
+    cr.stroke()
+
+    _border_surfaces[key] = surface
+    _border_keys.insert(0, key)
+    for old_key in _border_keys[iconcache.CACHE_SIZE:]:
+        del _border_surfaces[old_key]
+    del _border_keys[iconcache.CACHE_SIZE:]
+    return surface
+
+
 class ActivityIcon(CanvasIcon):
     __gtype_name__ = 'SugarFavoriteActivityIcon'
 
@@ -375,6 +426,7 @@ class ActivityIcon(CanvasIcon):
         self._journal_entries = []
         self._hovering = False
         self._resume_mode = True
+        self._xo_color = None
 
         self.connect('hovering-changed', self.__hovering_changed_event_cb)
         self.connect('button-release-event', self.__button_release_event_cb)
@@ -431,6 +483,7 @@ class ActivityIcon(CanvasIcon):
                                           style.COLOR_TRANSPARENT.get_svg()))
         else:
             xo_color = misc.get_icon_color(self._journal_entries[0])
+        self._xo_color = xo_color
         self.props.xo_color = xo_color
 
     def create_palette(self):
@@ -449,39 +502,36 @@ class ActivityIcon(CanvasIcon):
         self._hovering = hovering
         self.emit_paint_needed(0, 0, -1, -1)
 
+    def do_paint_below_children(self, cr, damaged_box):
+        # The layouts give the icons different sizes, the renderings are
+        # shared so that going back to a size does not render them again
+        if not iconcache.paint(self, cr,
+                               file_name=self._activity_info.get_icon(),
+                               xo_color=self._xo_color):
+            CanvasIcon.do_paint_below_children(self, cr, damaged_box)
+
     def do_paint_above_children(self, cr, damaged_box):
         if not self._hovering:
             return
 
         width, height = self.get_allocation()
-
-        x = ActivityIcon._BORDER_WIDTH / 2.0
-        y = ActivityIcon._BORDER_WIDTH / 2.0
-        width -= ActivityIcon._BORDER_WIDTH
-        height -= ActivityIcon._BORDER_WIDTH
-        radius = width / 10.0
-
-        cr.move_to(x + radius, y)
-        cr.arc(x + width - radius, y + radius, radius, math.pi * 1.5,
-               math.pi * 2.0)
-        cr.arc(x + width - radius, x + height - radius, radius, 0,
-               math.pi * 0.5)
-        cr.arc(x + radius, y + height - radius, radius, math.pi * 0.5, math.pi)
-        cr.arc(x + radius, y + radius, radius, math.pi, math.pi * 1.5)
-
-        color = style.COLOR_SELECTION_GREY.get_int()
-        hippo.cairo_set_source_rgba32(cr, color)
-        cr.set_line_width(ActivityIcon._BORDER_WIDTH)
-        cr.stroke()
+        cr.set_source_surface(_get_border_surface(width, height), 0, 0)
+        cr.paint()
 
     def do_get_content_height_request(self, for_width):
-        height, height = CanvasIcon.do_get_content_height_request(self,
-                                                                  for_width)
+        # CanvasIcon would render the icon in a buffer of its own to
+        # measure it, the size is known without that
+        height = self.props.size
+        if height is None:
+            height, height = CanvasIcon.do_get_content_height_request(
+                    self, for_width)
         height += ActivityIcon._BORDER_WIDTH * 2
         return height, height
 
     def do_get_content_width_request(self):
-        width, width = CanvasIcon.do_get_content_width_request(self)
+        width = self.props.size
+        if width is None:
+            width, width = CanvasIcon.do_get_content_width_request(self)
         width += ActivityIcon._BORDER_WIDTH * 2
         return width, width
 
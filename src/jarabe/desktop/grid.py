@@ -16,6 +16,7 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import random
+from collections import deque
 
 import gobject
 import gtk
@@ -23,11 +24,27 @@ import gtk
 from sugar import _sugarext
 
 
-_PLACE_TRIALS = 20
+_PLACE_TRIALS = 5
 _MAX_WEIGHT = 255
 _REFRESH_RATE = 200
 _MAX_COLLISIONS_PER_REFRESH = 20
 
+# Side, in cells, of the buckets of the spatial index
+_BUCKET_SIZE = 8
+
+# Times a child that could not be moved is tried again
+_MAX_SOLVE_RETRIES = 2
+
+_SHIFTS = [(1, 0), (-1, 0), (0, 1), (0, -1),
+           (1, 1), (-1, 1), (1, -1), (-1, -1)]
+
+# Distances, in cells, a colliding child is moved by
+_SHIFT_STEPS = [4, 2, 1]
+
+# Margin, in child sizes, around the best random position where free
+# space is looked for, see _get_free_position()
+_SEARCH_MARGIN = 1
+
 
 class Grid(_sugarext.Grid):
     __gsignals__ = {
@@ -43,8 +60,15 @@ class Grid(_sugarext.Grid):
         self._children = []
         self._child_rects = {}
         self._locked_children = set()
-        self._collisions = []
+        # children by bucket of _BUCKET_SIZE cells, see _get_buckets()
+        self._buckets = {}
+        # children waiting to be moved, in order, and their retries
+        self._collisions = deque()
+        self._collision_retries = {}
         self._collisions_sid = 0
+        # same weights as the C grid, to find free space, see
+        # _get_free_position()
+        self._weights = [[0] * self.width for i_ in range(self.height)]
 
         self.setup(self.width, self.height)
 
@@ -53,21 +77,29 @@ class Grid(_sugarext.Grid):
             rect = gtk.gdk.Rectangle(x, y, width, height)
             weight = self.compute_weight(rect)
         else:
-            trials = _PLACE_TRIALS
-            weight = _MAX_WEIGHT
-            while trials > 0 and weight:
-                x = int(random.random() * (self.width - width))
-                y = int(random.random() * (self.height - height))
-
-                rect = gtk.gdk.Rectangle(x, y, width, height)
-                new_weight = self.compute_weight(rect)
-                if weight > new_weight:
+            # A few random tries are enough while the grid is empty
+            probe = gtk.gdk.Rectangle(0, 0, width, height)
+            weight = None
+            for i_ in range(_PLACE_TRIALS):
+                probe.x = int(random.random() * (self.width - width))
+                probe.y = int(random.random() * (self.height - height))
+                new_weight = self.compute_weight(probe)
+                if weight is None or new_weight < weight:
                     weight = new_weight
+                    x, y = probe.x, probe.y
+                if not weight:
+                    break
 
-                trials -= 1
+            rect = gtk.gdk.Rectangle(x, y, width, height)
+            if weight:
+                position = self._get_free_position(rect)
+                if position is not None:
+                    rect.x, rect.y = position
+                    weight = 0
 
         self._child_rects[child] = rect
         self._children.append(child)
+        self._index_child(child)
         self.add_weight(self._child_rects[child])
         if locked:
             self._locked_children.add(child)
@@ -77,21 +109,24 @@ class Grid(_sugarext.Grid):
 
     def remove(self, child):
         self._children.remove(child)
+        self._unindex_child(child)
         self.remove_weight(self._child_rects[child])
         self._locked_children.discard(child)
         del self._child_rects[child]
 
-        if child in self._collisions:
-            self._collisions.remove(child)
+        # The queue skips the children that are not in the dictionary
+        self._collision_retries.pop(child, None)
 
     def move(self, child, x, y, locked=False):
         self.remove_weight(self._child_rects[child])
+        self._unindex_child(child)
 
         rect = self._child_rects[child]
         rect.x = x
         rect.y = y
 
         weight = self.compute_weight(rect)
+        self._index_child(child)
         self.add_weight(self._child_rects[child])
 
         if locked:
@@ -102,99 +137,178 @@ class Grid(_sugarext.Grid):
         if weight > 0:
             self._detect_collisions(child)
 
-    def _shift_child(self, child, weight):
-        rect = self._child_rects[child]
-
-        new_rects = []
-
-        # Get rects right, left, bottom and top
-        if (rect.x + rect.width < self.width - 1):
-            new_rects.append(gtk.gdk.Rectangle(rect.x + 1, rect.y,
-                                               rect.width, rect.height))
-
-        if (rect.x - 1 > 0):
-            new_rects.append(gtk.gdk.Rectangle(rect.x - 1, rect.y,
-                                               rect.width, rect.height))
-
-        if (rect.y + rect.height < self.height - 1):
-            new_rects.append(gtk.gdk.Rectangle(rect.x, rect.y + 1,
-                                               rect.width, rect.height))
-
-        if (rect.y - 1 > 0):
-            new_rects.append(gtk.gdk.Rectangle(rect.x, rect.y - 1,
-                                               rect.width, rect.height))
-
-        # Get diagonal rects
-        if rect.x + rect.width < self.width - 1 and \
-                rect.y + rect.height < self.height - 1:
-            new_rects.append(gtk.gdk.Rectangle(rect.x + 1, rect.y + 1,
-                                               rect.width, rect.height))
-
-        if rect.x - 1 > 0 and rect.y + rect.height < self.height - 1:
-            new_rects.append(gtk.gdk.Rectangle(rect.x - 1, rect.y + 1,
-                                               rect.width, rect.height))
-
-        if rect.x + rect.width < self.width - 1 and rect.y - 1 > 0:
-            new_rects.append(gtk.gdk.Rectangle(rect.x + 1, rect.y - 1,
-                                               rect.width, rect.height))
+    def add_weight(self, rect):
+        _sugarext.Grid.add_weight(self, rect)
+        self._update_weights(rect, 1)
+
+    def remove_weight(self, rect):
+        _sugarext.Grid.remove_weight(self, rect)
+        self._update_weights(rect, -1)
+
+    def _update_weights(self, rect, delta):
+        for y in range(max(rect.y, 0), min(rect.y + rect.height, self.height)):
+            row = self._weights[y]
+            for x in range(max(rect.x, 0),
+                           min(rect.x + rect.width, self.width)):
+                row[x] += delta
+
+    def _get_free_position(self, rect):
+        """Returns a random position around rect where a rect of the
+        same size does not overlap with any child, or None if that area
+        is too crowded
+
+        Only the area within _SEARCH_MARGIN child sizes of rect is
+        scanned, with a summed-area table s of its weights: the weight of
+        the rect at x, y of width w and height h is
+        s[y + h][x + w] - s[y][x + w] - s[y + h][x] + s[y][x].
+        """
+        width, height = rect.width, rect.height
+        # Same bounds as the random positions tried by add()
+        left = max(rect.x - width * _SEARCH_MARGIN, 0)
+        top = max(rect.y - height * _SEARCH_MARGIN, 0)
+        right = min(rect.x + width * (_SEARCH_MARGIN + 1), self.width - 1)
+        bottom = min(rect.y + height * (_SEARCH_MARGIN + 1), self.height - 1)
+
+        summed = [[0] * (right - left + 1)]
+        for row in self._weights[top:bottom]:
+            above = summed[-1]
+            summed_row = [0]
+            row_sum = 0
+            for x, weight in enumerate(row[left:right]):
+                row_sum += weight
+                summed_row.append(above[x + 1] + row_sum)
+            summed.append(summed_row)
+
+        free = []
+        for y in range(bottom - top - height + 1):
+            upper = summed[y]
+            lower = summed[y + height]
+            for x in range(right - left - width + 1):
+                if lower[x + width] - upper[x + width] - lower[x] + \
+                        upper[x] == 0:
+                    free.append((left + x, top + y))
+        if not free:
+            return None
+        return random.choice(free)
+
+    def _get_buckets(self, rect):
+        for bucket_x in range(rect.x / _BUCKET_SIZE,
+                              (rect.x + rect.width) / _BUCKET_SIZE + 1):
+            for bucket_y in range(rect.y / _BUCKET_SIZE,
+                                  (rect.y + rect.height) / _BUCKET_SIZE + 1):
+                yield bucket_x, bucket_y
+
+    def _index_child(self, child):
+        for bucket in self._get_buckets(self._child_rects[child]):
+            self._buckets.setdefault(bucket, set()).add(child)
+
+    def _unindex_child(self, child):
+        for bucket in self._get_buckets(self._child_rects[child]):
+            children = self._buckets.get(bucket)
+            if children is not None:
+                children.discard(child)
+                if not children:
+                    del self._buckets[bucket]
+
+    def _get_overlapping_children(self, child):
+        """Returns the other children that intersect with child"""
+        child_rect = self._child_rects[child]
+        candidates = set()
+        for bucket in self._get_buckets(child_rect):
+            candidates.update(self._buckets.get(bucket, ()))
+        candidates.discard(child)
 
-        if rect.x - 1 > 0 and rect.y - 1 > 0:
-            new_rects.append(gtk.gdk.Rectangle(rect.x - 1, rect.y - 1,
-                                               rect.width, rect.height))
+        return [c for c in candidates
+                if child_rect.intersect(self._child_rects[c]).width > 0]
 
-        random.shuffle(new_rects)
+    def _shift_child(self, child, weight):
+        """Move child while its weight decreases
 
-        best_rect = None
-        for new_rect in new_rects:
-            new_weight = self.compute_weight(new_rect)
-            if new_weight < weight:
-                best_rect = new_rect
-                weight = new_weight
+        Long moves are tried along with short ones, so a child in a
+        crowded area gets out of it in a few steps.
+        """
+        rect = self._child_rects[child]
+        x, y = rect.x, rect.y
+        probe = gtk.gdk.Rectangle(x, y, rect.width, rect.height)
+        shifts = [(dx * step, dy * step)
+                  for step in _SHIFT_STEPS for dx, dy in _SHIFTS]
+
+        while weight > 0:
+            random.shuffle(shifts)
+            best_position = None
+            for dx, dy in shifts:
+                probe.x = x + dx
+                probe.y = y + dy
+                if dx and (probe.x < 1 or
+                           probe.x + rect.width > self.width - 1):
+                    continue
+                if dy and (probe.y < 1 or
+                           probe.y + rect.height > self.height - 1):
+                    continue
+                new_weight = self.compute_weight(probe)
+                if new_weight < weight:
+                    best_position = probe.x, probe.y
+                    weight = new_weight
 
-        if best_rect:
-            self._child_rects[child] = best_rect
-            weight = self._shift_child(child, weight)
+            if best_position is None:
+                break
+            x, y = best_position
 
+        if (x, y) != (rect.x, rect.y):
+            self._child_rects[child] = gtk.gdk.Rectangle(x, y, rect.width,
+                                                         rect.height)
         return weight
 
+    def _queue_collision(self, child):
+        if child not in self._collision_retries:
+            self._collision_retries[child] = 0
+            self._collisions.append(child)
+
     def __solve_collisions_cb(self):
         for i_ in range(_MAX_COLLISIONS_PER_REFRESH):
-            collision = self._collisions.pop(0)
+            if not self._collisions:
+                break
+
+            collision = self._collisions.popleft()
+            retries = self._collision_retries.pop(collision, None)
+            if retries is None:
+                # removed from the grid
+                continue
 
             old_rect = self._child_rects[collision]
             self.remove_weight(old_rect)
+            self._unindex_child(collision)
             weight = self.compute_weight(old_rect)
             weight = self._shift_child(collision, weight)
+            self._index_child(collision)
             self.add_weight(self._child_rects[collision])
 
-            # TODO: we shouldn't give up the first time we failed to find a
-            # better position.
             if old_rect != self._child_rects[collision]:
                 self._detect_collisions(collision)
                 self.emit('child-changed', collision)
                 if weight > 0:
-                    self._collisions.append(collision)
+                    self._queue_collision(collision)
+            elif weight > 0 and retries < _MAX_SOLVE_RETRIES:
+                # The children around may have moved away by the time
+                # this one comes again
+                self._collision_retries[collision] = retries + 1
+                self._collisions.append(collision)
 
-            if not self._collisions:
-                self._collisions_sid = 0
-                return False
+        if not self._collisions:
+            self._collisions_sid = 0
+            return False
 
         return True
 
     def _detect_collisions(self, child):
         collision_found = False
-        child_rect = self._child_rects[child]
-        for c in self._children:
-            intersection = child_rect.intersect(self._child_rects[c])
-            if c != child and intersection.width > 0:
-                if (c not in self._locked_children and
-                    c not in self._collisions):
-                    collision_found = True
-                    self._collisions.append(c)
+        for c in self._get_overlapping_children(child):
+            if c not in self._locked_children:
+                collision_found = True
+                self._queue_collision(c)
 
         if collision_found:
-            if child not in self._collisions:
-                self._collisions.append(child)
+            self._queue_collision(child)
 
         if self._collisions and not self._collisions_sid:
             self._collisions_sid = gobject.timeout_add(_REFRESH_RATE,
@@ -202,3 +316,17 @@ class Grid(_sugarext.Grid):
 
     def get_child_rect(self, child):
         return self._child_rects[child]
+
+    def is_covered(self, child, children):
+        """Whether one of children contains the whole area of child
+
+        Locked children are never reported as covered.
+        """
+        if child in self._locked_children:
+            return False
+        rect = self._child_rects[child]
+        for c in self._get_overlapping_children(child):
+            if c in children and \
+                    rect.union(self._child_rects[c]) == self._child_rects[c]:
+                return True
+        return False
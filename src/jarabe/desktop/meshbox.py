@@ -36,6 +36,7 @@ from sugar.graphics.menuitem import MenuItem
 from jarabe.model import neighborhood
 from jarabe.model.buddy import get_owner_instance
 from jarabe.view.buddyicon import BuddyIcon
+from jarabe.view import iconcache
 from jarabe.desktop.snowflakelayout import SnowflakeLayout
 from jarabe.desktop.spreadlayout import SpreadLayout
 from jarabe.desktop.networkviews import WirelessNetworkView
@@ -64,6 +65,27 @@ class _ActivityIcon(CanvasIcon):
         self._model = model
         self.connect('activated', self._clicked_cb)
 
+    def do_paint_below_children(self, cr, damaged_box):
+        # The renderings are shared by the icons of the same activity
+        if not iconcache.paint(self, cr,
+                               file_name=self._model.bundle.get_icon(),
+                               xo_color=self._model.get_color()):
+            CanvasIcon.do_paint_below_children(self, cr, damaged_box)
+
+    def do_get_content_width_request(self):
+        # CanvasIcon would render the icon in a buffer of its own to
+        # measure it, the size is known without that
+        size = self.props.size
+        if size is None:
+            return CanvasIcon.do_get_content_width_request(self)
+        return size, size
+
+    def do_get_content_height_request(self, for_width):
+        size = self.props.size
+        if size is None:
+            return CanvasIcon.do_get_content_height_request(self, for_width)
+        return size, size
+
     def create_palette(self):
         primary_text = glib.markup_escape_text(self._model.bundle.get_name())
         secondary_text = glib.markup_escape_text(self._model.get_name())
@@ -421,6 +443,7 @@ class MeshBox(gtk.VBox):
         self._suspended = True
         self._query = ''
         self._owner_icon = None
+        self._batch_sid = 0
 
         self._toolbar = MeshToolbar()
         self._toolbar.connect('query-changed', self._toolbar_query_changed_cb)
@@ -438,6 +461,8 @@ class MeshBox(gtk.VBox):
         self._layout = SpreadLayout()
         self._layout_box.set_layout(self._layout)
 
+        self._layout.begin_batch()
+
         for buddy_model in self._model.get_buddies():
             self._add_buddy(buddy_model)
 
@@ -453,6 +478,8 @@ class MeshBox(gtk.VBox):
         netmgr_observer = NetworkManagerObserver(self)
         netmgr_observer.listen()
 
+        self._layout.end_batch()
+
     def do_size_allocate(self, allocation):
         width = allocation.width
         height = allocation.height
@@ -465,13 +492,27 @@ class MeshBox(gtk.VBox):
 
         gtk.VBox.do_size_allocate(self, allocation)
 
+    def _begin_batch(self):
+        # The presence service reports many buddies and activities in a
+        # row, they are placed together once it is done
+        if not self._batch_sid:
+            self._layout.begin_batch()
+            self._batch_sid = gobject.idle_add(self.__end_batch_cb)
+
+    def __end_batch_cb(self):
+        self._batch_sid = 0
+        self._layout.end_batch()
+        return False
+
     def _buddy_added_cb(self, model, buddy_model):
+        self._begin_batch()
         self._add_buddy(buddy_model)
 
     def _buddy_removed_cb(self, model, buddy_model):
         self._remove_buddy(buddy_model)
 
     def _activity_added_cb(self, model, activity_model):
+        self._begin_batch()
         self._add_activity(activity_model)
 
     def _activity_removed_cb(self, model, activity_model):
@@ -34,6 +34,10 @@ class SpreadLayout(gobject.GObject, hippo.CanvasLayout):
     def __init__(self):
         gobject.GObject.__init__(self)
         self._box = None
+        self._batch_depth = 0
+        # children added during a batch, with the position given by move()
+        self._pending_children = []
+        self._pending_positions = {}
 
         min_width, width = self.do_get_width_request()
         min_height, height = self.do_get_height_request(width)
@@ -42,18 +46,70 @@ class SpreadLayout(gobject.GObject, hippo.CanvasLayout):
         self._grid.connect('child-changed', self._grid_child_changed_cb)
 
     def add(self, child):
+        if self._batch_depth:
+            self._pending_children.append(child)
+            return
+
         self._box.append(child)
 
         width, height = self._get_child_grid_size(child)
         self._grid.add(child, width, height)
 
     def remove(self, child):
+        if child in self._pending_positions:
+            del self._pending_positions[child]
+        if child in self._pending_children:
+            self._pending_children.remove(child)
+            return
+
         self._grid.remove(child)
         self._box.remove(child)
 
     def move(self, child, x, y):
+        if child in self._pending_children:
+            self._pending_positions[child] = (x, y)
+            return
+
         self._grid.move(child, x / _CELL_SIZE, y / _CELL_SIZE, locked=True)
 
+    def begin_batch(self):
+        """Defer the placement of the children added until end_batch()
+
+        Batches can be nested, the children are placed when the outermost
+        one ends.
+        """
+        self._batch_depth += 1
+
+    def end_batch(self):
+        """Place all the children added since begin_batch() at once"""
+        self._batch_depth -= 1
+        if self._batch_depth > 0 or not self._pending_children:
+            return
+
+        pending_children = self._pending_children
+        children = []
+        for child in pending_children:
+            width, height = self._get_child_grid_size(child)
+            children.append((width * height, child, width, height))
+        positions = self._pending_positions
+        self._pending_children = []
+        self._pending_positions = {}
+
+        # Placing the biggest children first leaves the free space to the
+        # smaller ones, which find a spot more easily
+        children.sort(key=lambda entry: entry[0], reverse=True)
+        for area_, child, width, height in children:
+            if child in positions:
+                x, y = positions[child]
+                self._grid.add(child, width, height, int(x / _CELL_SIZE),
+                               int(y / _CELL_SIZE), locked=True)
+            else:
+                self._grid.add(child, width, height)
+
+        # The box asks for a single allocation once all are appended
+        for child in pending_children:
+            self._box.append(child)
+
     def do_set_box(self, box):
         self._box = box
 
@@ -63,19 +119,44 @@ class SpreadLayout(gobject.GObject, hippo.CanvasLayout):
     def do_get_width_request(self):
         return 0, gtk.gdk.screen_width()
 
+    def _get_viewport(self, width, height):
+        """Returns the part of the box that is on the screen"""
+        viewport = gtk.gdk.Rectangle(0, 0, width, height)
+        canvas = self._box.get_context()
+        if isinstance(canvas, gtk.Widget) and canvas.window is not None:
+            origin_x, origin_y = canvas.window.get_origin()
+            screen = gtk.gdk.Rectangle(-origin_x, -origin_y,
+                                       gtk.gdk.screen_width(),
+                                       gtk.gdk.screen_height())
+            viewport = viewport.intersect(screen)
+        return viewport
+
     def do_allocate(self, x, y, width, height,
                     req_width, req_height, origin_changed):
-        for child in self._box.get_layout_children():
+        viewport = self._get_viewport(width, height)
+        children = self._box.get_layout_children()
+        # The children are painted in order, the last ones on top
+        above = set([child.item for child in children])
+        for child in children:
+            above.discard(child.item)
+
             # We need to always get  requests to not confuse hippo
             min_w, child_width = child.get_width_request()
             min_h, child_height = child.get_height_request(child_width)
 
             rect = self._grid.get_child_rect(child.item)
-            child.allocate(int(round(rect.x * _CELL_SIZE)),
-                           int(round(rect.y * _CELL_SIZE)),
-                           child_width,
-                           child_height,
-                           origin_changed)
+            child_x = int(round(rect.x * _CELL_SIZE))
+            child_y = int(round(rect.y * _CELL_SIZE))
+            child_rect = gtk.gdk.Rectangle(child_x, child_y, child_width,
+                                           child_height)
+            if viewport.intersect(child_rect).width <= 0 or \
+                    self._grid.is_covered(child.item, above):
+                # Without an area the child is neither painted nor
+                # hovered, so its palette is not set up either
+                child.allocate(child_x, child_y, 0, 0, origin_changed)
+            else:
+                child.allocate(child_x, child_y, child_width, child_height,
+                               origin_changed)
 
     def _get_child_grid_size(self, child):
         min_width, width = child.get_width_request()
@@ -95,6 +95,8 @@ class ListModel(gtk.GenericTreeModel, gtk.TreeDragSource):
         self._result_set.progress.connect(self.__result_set_progress_cb)
 
     def __result_set_ready_cb(self, **kwargs):
+        # The result set can become ready again after its contents changed
+        self._last_requested_index = None
         self.emit('ready')
 
     def __result_set_progress_cb(self, **kwargs):
@@ -104,6 +106,8 @@ class ListModel(gtk.GenericTreeModel, gtk.TreeDragSource):
         self._result_set.setup()
 
     def stop(self):
+        self._result_set.ready.disconnect(self.__result_set_ready_cb)
+        self._result_set.progress.disconnect(self.__result_set_progress_cb)
         self._result_set.stop()
 
     def get_metadata(self, path):
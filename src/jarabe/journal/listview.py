@@ -123,7 +123,11 @@ class BaseListView(gtk.Bin):
         self._selection_cache = set()
 
     def get_mountpoint(self):
-        return self._query.get('mountpoints', [''])[0]
+        """Returns None when the entries come from several mount points"""
+        mount_points = self._query.get('mountpoints', [''])
+        if mount_points is None or len(mount_points) != 1:
+            return None
+        return mount_points[0]
 
     def __model_created_cb(self, sender, signal, object_id):
         if self._is_new_item_visible(object_id):
@@ -139,10 +143,16 @@ class BaseListView(gtk.Bin):
 
     def _is_new_item_visible(self, object_id):
         """Check if the created item is part of the currently selected view"""
-        if self._query['mountpoints'] == ['/']:
-            return not object_id.startswith('/')
-        else:
-            return object_id.startswith(self._query['mountpoints'][0])
+        mount_points = self._query['mountpoints']
+        if mount_points is None:
+            return True
+        for mount_point in mount_points:
+            if mount_point == '/':
+                if not object_id.startswith('/'):
+                    return True
+            elif object_id.startswith(mount_point):
+                return True
+        return False
 
     def __selected_cb(self, cell, path):
         self._model.toggle_selection(path)
@@ -338,7 +348,13 @@ class BaseListView(gtk.Bin):
 
 
     def __model_ready_cb(self, tree_model):
+        if tree_model is not self._model:
+            return
         self._model.add_selection(self._selection_cache)
+        if self.tree_view.get_model() is tree_model:
+            # The contents changed under us (the mount point is being
+            # monitored), make the tree view pick up the new length.
+            self.tree_view.set_model(None)
         self._refresh_view(tree_model)
 
     def _refresh_view(self, tree_model):
@@ -364,10 +380,12 @@ class BaseListView(gtk.Bin):
 
         if len(tree_model) == 0:
             if self._is_query_empty():
-                if self._query['mountpoints'] == ['/']:
+                mount_point = self.get_mountpoint()
+                if mount_point == '/':
                     self._show_message(_('Your Journal is empty'))
-                elif self._query['mountpoints'] == \
-                        [model.get_documents_path()]:
+                elif mount_point is None:
+                    self._show_message(_('Nothing to show'))
+                elif mount_point == model.get_documents_path():
                     self._show_message(_('Your documents folder is empty'))
                 else:
                     self._show_message(_('The device is empty'))
@@ -36,7 +36,7 @@ from sugar.bundle.contentbundle import ContentBundle
 from sugar import util
 
 from jarabe.view import launcher
-from jarabe.model import bundleregistry, shell
+from jarabe.model import bundleregistry, shell, zygote
 from jarabe.journal.journalentrybundle import JournalEntryBundle
 from jarabe.journal import model
 from jarabe.journal import journalwindow
@@ -140,13 +140,7 @@ def get_bundle(metadata):
 
 def _get_activities_for_mime(mime_type):
     registry = bundleregistry.get_registry()
-    result = registry.get_activities_for_type(mime_type)
-    if not result:
-        for parent_mime in mime.get_mime_parents(mime_type):
-            for activity in registry.get_activities_for_type(parent_mime):
-                if activity not in result:
-                    result.append(activity)
-    return result
+    return registry.get_activities_for_type(mime_type, include_parents=True)
 
 
 def get_activities(metadata):
@@ -266,7 +260,11 @@ def launch(bundle, activity_id=None, object_id=None, uri=None, color=None,
     launcher.add_launcher(activity_id, bundle.get_icon(), color)
     activity_handle = ActivityHandle(activity_id=activity_id,
             object_id=object_id, uri=uri, invited=invited)
-    activityfactory.create(bundle, activity_handle)
+    if hasattr(bundle, 'get_bundle'):
+        # Registry entries only describe the bundle
+        bundle = bundle.get_bundle()
+    if not zygote.launch(bundle, activity_handle):
+        activityfactory.create(bundle, activity_handle)
 
 
 def _downgrade_option_alert(bundle):
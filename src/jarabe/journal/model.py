@@ -24,7 +24,6 @@ import shutil
 import tempfile
 from stat import S_IFLNK, S_IFMT, S_IFDIR, S_IFREG
 import re
-from operator import itemgetter
 import simplejson
 from gettext import gettext as _
 
@@ -50,9 +49,27 @@ PROPERTIES = ['activity', 'activity_id', 'buddies', 'bundle_id',
 MIN_PAGES_TO_CACHE = 3
 MAX_PAGES_TO_CACHE = 5
 
+# Delay before processing file system changes on a mount point, so
+# bursts of events (like a file being written) are handled once.
+_MONITOR_DELAY = 500
+# Upper bound on the directories watched for a single mount point,
+# inotify watches are a limited resource.
+_MAX_MONITORS = 256
+# Entries of a previous result set checked per idle call when refining
+# a search.
+_REFINE_CHUNK = 50
+
 JOURNAL_METADATA_DIR = '.Sugar-Metadata'
 
 _datastore = None
+# Number of mount points whose last result set is kept
+_MAX_LIVE_RESULT_SETS = 4
+# Stopped result sets whose file monitors keep their file list up to
+# date, by mount point, until the volume is unmounted. The next query on
+# the mount point starts from that list instead of scanning the volume.
+_live_result_sets = {}
+# The mount points of _live_result_sets, most recently used first
+_live_mount_points = []
 created = dispatch.Signal()
 updated = dispatch.Signal()
 deleted = dispatch.Signal()
@@ -132,6 +149,13 @@ class BaseResultSet(object):
     def seek(self, position):
         self._position = position
 
+    def get_sort_key(self, position, order_by):
+        """Return the values the entry at position is sorted by"""
+        self.seek(position)
+        metadata = self.read()
+        return [_normalize_sort_value(metadata.get(property_, ''))
+                for property_, descending_ in order_by]
+
     def read(self):
         if self._position == -1:
             self.seek(0)
@@ -250,6 +274,7 @@ class InplaceResultSet(BaseResultSet):
         self._pending_directories = []
         self._visited_directories = []
         self._pending_files = []
+        self._pending_file_infos = []
         self._stopped = False
 
         query_text = query.get('query', '')
@@ -272,9 +297,27 @@ class InplaceResultSet(BaseResultSet):
 
         self._mime_types = query.get('mime_type', [])
 
-        self._sort = query.get('order_by', ['+timestamp'])[0]
+        self._order_by = _parse_order_by(query)
+        # Properties whose values are kept in each file list entry
+        self._sort_properties = [property_ for property_, descending_
+                                 in self._order_by]
+        # Sort properties not computed yet for the entries being refined
+        self._missing_sort_properties = []
+
+        self._monitors = {}
+        self._monitors_complete = True
+        self._scanned = False
+        self._changed_paths = set()
+        self._changes_sid = None
 
     def setup(self):
+        self._stopped = False
+        if self._pending_file_infos:
+            # Filtering the entries of a broader search, see refine()
+            self._file_list = []
+            gobject.idle_add(self._scan)
+            return
+
         self._file_list = []
         self._pending_directories = [self._mount_point]
         self._visited_directories = []
@@ -283,17 +326,100 @@ class InplaceResultSet(BaseResultSet):
 
     def stop(self):
         self._stopped = True
+        if not self.is_live():
+            self.stop_monitoring()
+            return
 
-    def setup_ready(self):
-        if self._sort[1:] == 'filesize':
-            keygetter = itemgetter(3)
+        kept = _live_result_sets.get(self._mount_point)
+        if kept is self:
+            return
+        if kept is not None and _narrows_query(self._query, kept._query):
+            # The kept result set has all of these entries, and more
+            self.stop_monitoring()
+            _keep_result_set(kept)
         else:
-            # timestamp
-            keygetter = itemgetter(2)
-        self._file_list.sort(lambda a, b: cmp(b, a),
-                             key=keygetter,
-                             reverse=(self._sort[0] == '-'))
-        self.ready.send(self)
+            if kept is not None:
+                kept.stop_monitoring()
+            _keep_result_set(self)
+
+    def refine(self, result_set):
+        """Take the entries to filter from a live stopped search
+
+        Used instead of scanning the volume when this query only narrows
+        the one of result_set or sorts it differently. The directories
+        result_set is monitoring are monitored too, and the changes it
+        has not processed yet are processed once the entries are
+        filtered.
+        """
+        self._pending_file_infos = result_set._file_list[:]
+        self._sort_properties = result_set._sort_properties[:]
+        self._missing_sort_properties = [property_ for property_, descending_
+                                         in self._order_by
+                                         if property_ not in
+                                            self._sort_properties]
+        self._sort_properties.extend(self._missing_sort_properties)
+        self._changed_paths.update(result_set._changed_paths)
+
+        for dir_path in result_set._monitors.keys():
+            self._monitor_directory(dir_path)
+
+    def is_live(self):
+        """Whether the file list is complete and followed by monitors"""
+        return self._scanned and self._monitors_complete
+
+    def stop_monitoring(self):
+        for monitor in self._monitors.values():
+            monitor.cancel()
+        self._monitors = {}
+        self._monitors_complete = False
+        if self._changes_sid is not None:
+            gobject.source_remove(self._changes_sid)
+            self._changes_sid = None
+        if _live_result_sets.get(self._mount_point) is self:
+            del _live_result_sets[self._mount_point]
+            _live_mount_points.remove(self._mount_point)
+
+    def get_sort_key(self, position, order_by):
+        # Same values the file list is sorted by, from the file itself
+        # for the time stamp and size
+        values = self._file_list[position][3]
+        return [values[self._sort_properties.index(property_)]
+                for property_, descending_ in order_by]
+
+    def _sort_file_list(self):
+        indexes = [self._sort_properties.index(property_)
+                   for property_, descending_ in self._order_by]
+        directions = set([descending for property_, descending
+                          in self._order_by])
+        if len(directions) == 1:
+            self._file_list.sort(
+                    key=lambda file_info: [file_info[3][index]
+                                           for index in indexes],
+                    reverse=directions.pop())
+            return
+
+        # The sort is stable, so sorting by each key from the least
+        # significant one gives the multi-key order.
+        for property_, descending in reversed(self._order_by):
+            index = self._sort_properties.index(property_)
+            self._file_list.sort(key=lambda file_info: file_info[3][index],
+                                 reverse=descending)
+
+    def setup_ready(self):
+        self._sort_file_list()
+        self._scanned = True
+        self._file_list_changed()
+
+        if self._changed_paths and self._changes_sid is None:
+            self._changes_sid = gobject.timeout_add(_MONITOR_DELAY,
+                                                    self.__process_changes_cb)
+
+    def _file_list_changed(self):
+        del self._cache[:]
+        self._offset = 0
+        self._total_count = -1
+        if not self._stopped:
+            self.ready.send(self)
 
     def find(self, query):
         if self._file_list is None:
@@ -311,7 +437,7 @@ class InplaceResultSet(BaseResultSet):
         files = self._file_list[offset:offset + limit]
 
         entries = []
-        for file_path, stat, mtime_, size_, metadata in files:
+        for file_path, stat, metadata, values_ in files:
             if metadata is None:
                 metadata = _get_file_metadata(file_path, stat)
             metadata['mountpoint'] = self._mount_point
@@ -327,6 +453,10 @@ class InplaceResultSet(BaseResultSet):
 
         self.progress.send(self)
 
+        if self._pending_file_infos:
+            self._filter_file_infos()
+            return True
+
         if self._pending_files:
             self._scan_a_file()
             return True
@@ -339,8 +469,50 @@ class InplaceResultSet(BaseResultSet):
         self._visited_directories = []
         return False
 
+    def _filter_file_infos(self):
+        file_infos = self._pending_file_infos[:_REFINE_CHUNK]
+        del self._pending_file_infos[:_REFINE_CHUNK]
+
+        for full_path, stat, metadata, values in file_infos:
+            matches, metadata = self._match_text(full_path, stat, metadata)
+            if matches:
+                missing_values, metadata = _get_sort_values(
+                        self._missing_sort_properties, full_path, stat,
+                        metadata)
+                self._file_list.append((full_path, stat, metadata,
+                                        values + missing_values))
+
+    def _match_text(self, full_path, stat, metadata):
+        """Check the query text against a file and its metadata
+
+        Returns whether it matches and the metadata, read if needed.
+        """
+        if self._regex is None or self._regex.match(full_path):
+            return True, metadata
+
+        if metadata is None:
+            metadata = _get_file_metadata(full_path, stat,
+                                          fetch_preview=False)
+            if not metadata:
+                return False, None
+        for f in ['fulltext', 'title',
+                  'description', 'tags']:
+            if f in metadata and \
+                    self._regex.match(metadata[f]):
+                return True, metadata
+        return False, metadata
+
     def _scan_a_file(self):
         full_path = self._pending_files.pop(0)
+        file_info = self._get_file_info(full_path)
+        if file_info is not None:
+            self._file_list.append(file_info)
+
+    def _get_file_info(self, full_path):
+        """Return the list entry for a path if it matches the query
+
+        Directories are queued for scanning instead.
+        """
         metadata = None
 
         try:
@@ -349,7 +521,7 @@ class InplaceResultSet(BaseResultSet):
             if e.errno != errno.ENOENT:
                 logging.exception(
                     'Error reading metadata of file %r', full_path)
-            return
+            return None
 
         if S_IFMT(stat.st_mode) == S_IFLNK:
             try:
@@ -360,7 +532,7 @@ class InplaceResultSet(BaseResultSet):
                 return
 
             if not os.path.abspath(link).startswith(self._mount_point):
-                return
+                return None
 
             try:
                 stat = os.stat(full_path)
@@ -369,50 +541,36 @@ class InplaceResultSet(BaseResultSet):
                 if e.errno != errno.ENOENT:
                     logging.exception(
                         'Error reading metadata of linked file %r', full_path)
-                return
+                return None
 
         if S_IFMT(stat.st_mode) == S_IFDIR:
             id_tuple = stat.st_ino, stat.st_dev
             if not id_tuple in self._visited_directories:
                 self._visited_directories.append(id_tuple)
                 self._pending_directories.append(full_path)
-            return
+            return None
 
         if S_IFMT(stat.st_mode) != S_IFREG:
-            return
+            return None
 
-        if self._regex is not None and \
-                not self._regex.match(full_path):
-            metadata = _get_file_metadata(full_path, stat,
-                                          fetch_preview=False)
-            if not metadata:
-                return
-            add_to_list = False
-            for f in ['fulltext', 'title',
-                      'description', 'tags']:
-                if f in metadata and \
-                        self._regex.match(metadata[f]):
-                    add_to_list = True
-                    break
-            if not add_to_list:
-                return
+        matches, metadata = self._match_text(full_path, stat, metadata)
+        if not matches:
+            return None
 
         if self._date_start is not None and stat.st_mtime < self._date_start:
-            return
+            return None
 
         if self._date_end is not None and stat.st_mtime > self._date_end:
-            return
+            return None
 
         if self._mime_types:
             mime_type = gio.content_type_guess(filename=full_path)
             if mime_type not in self._mime_types:
-                return
+                return None
 
-        file_info = (full_path, stat, int(stat.st_mtime), stat.st_size,
-                     metadata)
-        self._file_list.append(file_info)
-
-        return
+        values, metadata = _get_sort_values(self._sort_properties, full_path,
+                                            stat, metadata)
+        return (full_path, stat, metadata, values)
 
     def _scan_a_directory(self):
         dir_path = self._pending_directories.pop(0)
@@ -424,12 +582,257 @@ class InplaceResultSet(BaseResultSet):
                 logging.exception('Error reading directory %r', dir_path)
             return
 
+        self._monitor_directory(dir_path)
+
         for entry in entries:
             if entry.startswith('.'):
                 continue
             self._pending_files.append(dir_path + '/' + entry)
         return
 
+    def _monitor_directory(self, dir_path):
+        if dir_path in self._monitors:
+            return
+        if len(self._monitors) >= _MAX_MONITORS:
+            logging.debug('Too many directories in %r, not monitoring %r',
+                          self._mount_point, dir_path)
+            self._monitors_complete = False
+            return
+        try:
+            monitor = gio.File(dir_path).monitor_directory()
+        except gio.Error:
+            logging.exception('Could not monitor directory %r', dir_path)
+            self._monitors_complete = False
+            return
+        monitor.connect('changed', self.__monitor_changed_cb)
+        self._monitors[dir_path] = monitor
+
+    def __monitor_changed_cb(self, monitor, one_file, other_file,
+                             event_type):
+        path = one_file.get_path()
+        if event_type == gio.FILE_MONITOR_EVENT_UNMOUNTED or \
+                (event_type == gio.FILE_MONITOR_EVENT_DELETED and
+                 path == self._mount_point):
+            self.stop_monitoring()
+            return
+
+        if event_type not in [gio.FILE_MONITOR_EVENT_CREATED,
+                              gio.FILE_MONITOR_EVENT_DELETED,
+                              gio.FILE_MONITOR_EVENT_CHANGES_DONE_HINT,
+                              gio.FILE_MONITOR_EVENT_ATTRIBUTE_CHANGED]:
+            return
+        if path is None or os.path.basename(path).startswith('.'):
+            return
+
+        self._changed_paths.add(path)
+        if self._changes_sid is None:
+            self._changes_sid = gobject.timeout_add(_MONITOR_DELAY,
+                                                    self.__process_changes_cb)
+
+    def __process_changes_cb(self):
+        self._changes_sid = None
+        changed_paths = self._changed_paths
+        self._changed_paths = set()
+
+        if not self._scanned:
+            # Processed once the scan is done, see setup_ready()
+            self._changed_paths.update(changed_paths)
+            return False
+
+        logging.debug('InplaceResultSet updating %d paths on %r',
+                      len(changed_paths), self._mount_point)
+
+        changed = False
+        for path in changed_paths:
+            if self._remove_path(path):
+                changed = True
+            file_info = self._get_file_info(path)
+            if file_info is not None:
+                self._file_list.append(file_info)
+                changed = True
+
+        if self._pending_directories and self._stopped:
+            # Nothing scans them, the file list is not complete anymore
+            self.stop_monitoring()
+        elif self._pending_directories:
+            # New directories appeared, scan them like the rest of the
+            # volume; setup_ready() will be called when done.
+            gobject.idle_add(self._scan)
+        elif changed:
+            # Almost sorted already, so this is close to linear
+            self._sort_file_list()
+            self._file_list_changed()
+
+        return False
+
+    def _remove_path(self, path):
+        """Drop a path and everything below it from the file list"""
+        prefix = path + '/'
+        for dir_path in self._monitors.keys():
+            if dir_path == path or dir_path.startswith(prefix):
+                self._monitors.pop(dir_path).cancel()
+
+        length = len(self._file_list)
+        self._file_list = [file_info for file_info in self._file_list
+                           if file_info[0] != path and
+                              not file_info[0].startswith(prefix)]
+        return len(self._file_list) != length
+
+
+class FederatedResultSet(BaseResultSet):
+    """Encapsulates the merged results of a query on several mount points
+
+    Each mount point is queried through its own result set, all of them
+    at the same time. Results are merged lazily by the sort property,
+    so only the entries up to the requested position are compared and
+    each source keeps paging through its own cache.
+    """
+    def __init__(self, query, page_size, mount_points):
+        BaseResultSet.__init__(self, query, page_size)
+
+        self._order_by = _parse_order_by(query)
+        self._result_sets = []
+        for mount_point in mount_points:
+            result_set = _find_in_mount_point(query.copy(), page_size,
+                                              mount_point)
+            result_set.ready.connect(self.__result_set_ready_cb)
+            result_set.progress.connect(self.__result_set_progress_cb)
+            self._result_sets.append(result_set)
+
+        self._pending_result_sets = []
+        self._reset_merge()
+
+    def setup(self):
+        self._pending_result_sets = self._result_sets[:]
+        for result_set in self._result_sets:
+            result_set.setup()
+
+    def stop(self):
+        for result_set in self._result_sets:
+            result_set.ready.disconnect(self.__result_set_ready_cb)
+            result_set.progress.disconnect(self.__result_set_progress_cb)
+            result_set.stop()
+
+    def __result_set_ready_cb(self, sender, **kwargs):
+        if sender in self._pending_result_sets:
+            self._pending_result_sets.remove(sender)
+        if self._pending_result_sets:
+            return
+
+        # Also reached when a source changed after being ready.
+        self._reset_merge()
+        del self._cache[:]
+        self._offset = 0
+        self._total_count = -1
+        self.ready.send(self)
+
+    def __result_set_progress_cb(self, sender, **kwargs):
+        self.progress.send(self)
+
+    def _reset_merge(self):
+        # (result set index, position in that result set) for each
+        # merged entry computed so far
+        self._merged = []
+        self._heads = [0] * len(self._result_sets)
+        self._head_keys = [None] * len(self._result_sets)
+
+    def _get_head_key(self, index):
+        if self._head_keys[index] is None:
+            result_set = self._result_sets[index]
+            self._head_keys[index] = result_set.get_sort_key(
+                    self._heads[index], self._order_by)
+        return self._head_keys[index]
+
+    def _goes_before(self, key, other_key):
+        for i, (property_, descending) in enumerate(self._order_by):
+            if key[i] != other_key[i]:
+                return (key[i] > other_key[i]) == descending
+        return False
+
+    def _merge_up_to(self, position):
+        lengths = [result_set.length for result_set in self._result_sets]
+        while len(self._merged) < position:
+            best = None
+            best_key = None
+            for index, result_set in enumerate(self._result_sets):
+                if self._heads[index] >= lengths[index]:
+                    continue
+                key = self._get_head_key(index)
+                if best is None or self._goes_before(key, best_key):
+                    best, best_key = index, key
+            if best is None:
+                break
+            self._merged.append((best, self._heads[best]))
+            self._heads[best] += 1
+            self._head_keys[best] = None
+
+    def find(self, query):
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 0))
+        total_count = sum([result_set.length
+                           for result_set in self._result_sets])
+
+        self._merge_up_to(min(offset + limit, total_count))
+
+        entries = []
+        for index, position in self._merged[offset:offset + limit]:
+            result_set = self._result_sets[index]
+            result_set.seek(position)
+            entries.append(result_set.read())
+
+        return entries, total_count
+
+
+def _parse_order_by(query):
+    """Return (property, descending) pairs for the order_by of a query
+
+    As in the datastore, '+' sorts with the highest values first.
+    """
+    order_by = []
+    for key in query.get('order_by', None) or ['+timestamp']:
+        if key[0] in '+-':
+            order_by.append((key[1:], key[0] == '+'))
+        else:
+            order_by.append((key, True))
+    return order_by
+
+
+def _normalize_sort_value(value):
+    """Make numeric strings compare as numbers and text case-insensitive"""
+    if isinstance(value, basestring):
+        try:
+            return float(value)
+        except ValueError:
+            return value.lower()
+    return value
+
+
+def _get_sort_values(properties, file_path, stat, metadata):
+    """Return the values a file is sorted by for each property
+
+    The time stamp and size come from the file itself, anything else
+    needs the metadata, which is read if needed and returned along so
+    that it is kept with the file.
+    """
+    values = []
+    for property_ in properties:
+        if property_ == 'timestamp':
+            values.append(int(stat.st_mtime))
+            continue
+        elif property_ == 'filesize':
+            values.append(stat.st_size)
+            continue
+
+        if metadata is None:
+            metadata = _get_file_metadata(file_path, stat,
+                                          fetch_preview=False)
+        if property_ == 'creation_time' and property_ not in metadata:
+            values.append(int(stat.st_mtime))
+        else:
+            values.append(_normalize_sort_value(metadata.get(property_, '')))
+    return tuple(values), metadata
+
+
 def _set_signals_state(state, callback=None, data=None):
     global _sync_signals_enabled
     _sync_signals_enabled = state
@@ -452,20 +855,29 @@ def copy_entries(entries_set, mount_point):
     return (status, message)
 
 def delete_entries(entries_set, mount_point):
+    """Delete entries, mount_point is None if they are from several"""
     _set_signals_state(False)
     for entry_uid in entries_set:
         try:
             delete(entry_uid)
         except (OSError, IOError):
             logging.warning('Entry %s could not be deleted', entry_uid)
-    gobject.idle_add(_set_signals_state, True,
-                     __post_delete_entries_cb, mount_point)
+    if mount_point is None:
+        gobject.idle_add(_set_signals_state, True,
+                         __post_delete_entries_from_cb, list(entries_set))
+    else:
+        gobject.idle_add(_set_signals_state, True,
+                         __post_delete_entries_cb, mount_point)
 
 def __post_delete_entries_cb(mount_point):
     if mount_point is '/':
         mount_point = 'abcde'
     _emit_deleted(mount_point)
 
+def __post_delete_entries_from_cb(entries):
+    for entry_uid in entries:
+        _emit_deleted(entry_uid)
+
 
 
 def _get_file_metadata(path, stat, fetch_preview=True):
@@ -562,17 +974,95 @@ def _datastore_deleted_cb(object_id):
 
 def find(query_, page_size):
     """Returns a ResultSet
+
+    The query can name several mount points, or None to search all of
+    them; the results are then merged in the requested order.
     """
     query = query_.copy()
 
     mount_points = query.pop('mountpoints', ['/'])
-    if mount_points is None or len(mount_points) != 1:
-        raise ValueError('Exactly one mount point must be specified')
+    if mount_points is None:
+        mount_points = get_mount_points()
+    if not mount_points:
+        raise ValueError('At least one mount point must be specified')
 
-    if mount_points[0] == '/':
-        return DatastoreResultSet(query, page_size)
+    if len(mount_points) == 1:
+        return _find_in_mount_point(query, page_size, mount_points[0])
     else:
-        return InplaceResultSet(query, page_size, mount_points[0])
+        return FederatedResultSet(query, page_size, mount_points)
+
+
+def _find_in_mount_point(query, page_size, mount_point):
+    if mount_point == '/':
+        return DatastoreResultSet(query, page_size)
+
+    result_set = InplaceResultSet(query, page_size, mount_point)
+    live_result_set = _live_result_sets.get(mount_point)
+    if live_result_set is not None and \
+            _narrows_query(query, live_result_set._query):
+        result_set.refine(live_result_set)
+        _keep_result_set(live_result_set)
+    return result_set
+
+
+def _keep_result_set(result_set):
+    """Keep the live result set of a mount point, as most recently used
+
+    The result sets of the least recently used mount points stop
+    monitoring beyond _MAX_LIVE_RESULT_SETS.
+    """
+    mount_point = result_set._mount_point
+    if mount_point in _live_mount_points:
+        _live_mount_points.remove(mount_point)
+    _live_mount_points.insert(0, mount_point)
+    _live_result_sets[mount_point] = result_set
+
+    for old_mount_point in _live_mount_points[_MAX_LIVE_RESULT_SETS:]:
+        _live_result_sets[old_mount_point].stop_monitoring()
+
+
+def _narrows_query(query, old_query):
+    """Whether the results of query are a subset of those of old_query
+
+    True when only the search text and the order differ, and every word
+    of the old text is contained in a word of the new one.
+    """
+    query = query.copy()
+    old_query = old_query.copy()
+    query.pop('order_by', None)
+    old_query.pop('order_by', None)
+    text = query.pop('query', '')
+    old_text = old_query.pop('query', '')
+    if query != old_query:
+        return False
+    if text == old_text:
+        return True
+    if text.startswith('"') or old_text.startswith('"'):
+        return False
+
+    words = text.lower().split()
+    for old_word in old_text.lower().split():
+        for word in words:
+            if old_word in word:
+                break
+        else:
+            return False
+    return True
+
+
+def get_mount_points():
+    """Returns the journal, the documents folder and the mounted volumes
+    """
+    mount_points = ['/']
+    documents_path = get_documents_path()
+    if documents_path is not None:
+        mount_points.append(documents_path)
+    volume_monitor = gio.volume_monitor_get()
+    for mount in volume_monitor.get_mounts():
+        mount_point = mount.get_root().get_path()
+        if mount_point is not None and mount_point not in mount_points:
+            mount_points.append(mount_point)
+    return mount_points
 
 
 def _get_mount_point(path):
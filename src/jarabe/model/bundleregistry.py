@@ -17,12 +17,15 @@
 
 import os
 import logging
+import locale
+import tempfile
 
 import gconf
 import gobject
 import gio
 import simplejson
 
+from sugar import mime
 from sugar.bundle.activitybundle import ActivityBundle
 from sugar.bundle.contentbundle import ContentBundle
 from sugar.bundle.bundleversion import NormalizedVersion
@@ -33,10 +36,292 @@ from sugar import env
 
 from jarabe import config
 from jarabe.model import mimeregistry
+from jarabe.util import bundleinstall
 
 
 _instance = None
 
+# Bump when the fields stored in the registry cache change
+_CACHE_VERSION = 1
+
+# Milliseconds to wait for more favorite changes before saving them
+_FAVORITES_WRITE_DELAY = 2000
+
+# Milliseconds without activity directory changes before processing them
+_MONITOR_DELAY = 1000
+
+# Times a bundle that cannot be loaded once its files stopped changing
+# is checked again
+_MONITOR_MAX_RETRIES = 10
+
+# Milliseconds to wait for more MIME types before rebuilding the database
+_MIME_UPDATE_DELAY = 3000
+
+
+def _write_json_atomically(path, data, **kwargs):
+    """Write data as JSON to path, which keeps its previous contents
+    until the new ones are safely on disk.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        f = os.fdopen(fd, 'w')
+        try:
+            simplejson.dump(data, f, **kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(temp_path, path)
+    except:
+        # pylint: disable=W0702
+        os.unlink(temp_path)
+        raise
+
+
+class _BundleInfo(object):
+    """Lightweight description of an installed activity bundle
+
+    Only the activity.info fields the shell needs all the time are
+    kept. The full ActivityBundle is created the first time something
+    else is asked, like launching the activity, see get_bundle().
+    """
+
+    __slots__ = ['_path', '_bundle_id', '_activity_version', '_name',
+                 '_icon', '_mime_types', '_show_launcher', '_tags',
+                 '_installation_time', '_version_key', '_bundle']
+
+    def __init__(self, path, fields):
+        self._path = path
+        self._bundle_id = fields['bundle_id']
+        self._activity_version = fields['activity_version']
+        self._name = fields['name']
+        self._icon = fields['icon']
+        self._mime_types = fields['mime_types']
+        self._show_launcher = fields['show_launcher']
+        self._tags = fields['tags']
+        self._installation_time = fields['installation_time']
+        self._version_key = None
+        self._bundle = None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get_bundle(), name)
+
+    def get_bundle(self):
+        """Returns the ActivityBundle, parsing it if needed"""
+        if self._bundle is None:
+            logging.debug('Loading the full bundle %r', self._path)
+            self._bundle = ActivityBundle(self._path)
+        return self._bundle
+
+    def get_path(self):
+        return self._path
+
+    def get_bundle_id(self):
+        return self._bundle_id
+
+    def get_activity_version(self):
+        return self._activity_version
+
+    def get_version_key(self):
+        """Returns the parsed activity version, for comparisons"""
+        if self._version_key is None:
+            self._version_key = NormalizedVersion(self._activity_version)
+        return self._version_key
+
+    def get_name(self):
+        return self._name
+
+    def get_icon(self):
+        return self._icon
+
+    def get_mime_types(self):
+        return self._mime_types
+
+    def get_show_launcher(self):
+        return self._show_launcher
+
+    def get_tags(self):
+        return self._tags
+
+    def get_installation_time(self):
+        return self._installation_time
+
+    def is_user_activity(self):
+        return self._path.startswith(env.get_user_activities_path())
+
+
+def _get_version_key(bundle):
+    if isinstance(bundle, _BundleInfo):
+        return bundle.get_version_key()
+    return NormalizedVersion(bundle.get_activity_version())
+
+
+def _get_bundle_fields(bundle):
+    return {'bundle_id': bundle.get_bundle_id(),
+            'activity_version': bundle.get_activity_version(),
+            'name': bundle.get_name(),
+            'icon': bundle.get_icon(),
+            'mime_types': bundle.get_mime_types(),
+            'show_launcher': bundle.get_show_launcher(),
+            'tags': bundle.get_tags(),
+            'installation_time': bundle.get_installation_time()}
+
+
+def _get_tree_fingerprint(path):
+    """Return the number, total size and last change of the files"""
+    count = 0
+    size = 0
+    mtime = 0
+    for dir_path, dir_names, file_names in os.walk(path):
+        for name in dir_names + file_names:
+            try:
+                stat = os.lstat(os.path.join(dir_path, name))
+            except OSError:
+                continue
+            count += 1
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime)
+    return count, size, mtime
+
+
+class _RegistryCache(object):
+    """Parsed activity.info files of the installed bundles
+
+    Entries are validated by modification times, of the activity
+    directories for their listing and of each bundle for its fields.
+    The localized names depend on the locale, so a locale change
+    discards the whole cache.
+    """
+
+    def __init__(self):
+        self._path = env.get_profile_path('bundle_registry_cache')
+        self._locale = repr(locale.getdefaultlocale())
+        self._directories = {}
+        self._bundles = {}
+        self._used_bundles = set()
+        self._dirty = False
+
+        if os.path.exists(self._path):
+            try:
+                self._load()
+            except Exception:
+                logging.exception('Error while loading the registry cache.')
+                self._directories = {}
+                self._bundles = {}
+
+    def _load(self):
+        cache_data = simplejson.load(open(self._path))
+        if cache_data.get('version') != _CACHE_VERSION or \
+                cache_data.get('locale') != self._locale:
+            logging.debug('Discarding outdated registry cache')
+            self._dirty = True
+            return
+        self._directories = cache_data['directories']
+        self._bundles = cache_data['bundles']
+
+    def get_directory(self, path, mtime):
+        """Return the bundle directories of path and their mtimes"""
+        entry = self._directories.get(path)
+        if entry is None or entry['mtime'] != mtime:
+            return None
+        return entry['bundles']
+
+    def set_directory(self, path, mtime, bundles):
+        self._directories[path] = {'mtime': mtime, 'bundles': bundles}
+        self._dirty = True
+
+    def get_bundle(self, path, mtimes):
+        entry = self._bundles.get(path)
+        if entry is None or entry['mtimes'] != mtimes:
+            return None
+        self._used_bundles.add(path)
+        return entry['fields']
+
+    def set_bundle(self, path, mtimes, fields):
+        self._bundles[path] = {'mtimes': mtimes, 'fields': fields}
+        self._used_bundles.add(path)
+        self._dirty = True
+
+    def remove_bundle(self, path):
+        if path in self._bundles:
+            del self._bundles[path]
+            self._used_bundles.discard(path)
+            self._dirty = True
+
+    def write(self):
+        if not self._dirty:
+            return
+
+        bundles = dict([(path, entry)
+                        for path, entry in self._bundles.iteritems()
+                        if path in self._used_bundles])
+        cache_data = {'version': _CACHE_VERSION,
+                      'locale': self._locale,
+                      'directories': self._directories,
+                      'bundles': bundles}
+        try:
+            _write_json_atomically(self._path, cache_data)
+        except (EnvironmentError, TypeError, ValueError):
+            logging.exception('Error while writing the registry cache.')
+        else:
+            self._dirty = False
+
+
+class _MimeInstaller(object):
+    """Installs the MIME types and icons of activity bundles
+
+    The files are linked right away but the shared MIME database is
+    rebuilt once for all the bundles added in a row, by a background
+    update-mime-database process.
+    """
+
+    def __init__(self):
+        self._update_sid = None
+        self._update_pid = None
+        self._update_again = False
+
+    def install(self, bundle):
+        try:
+            if bundleinstall.link_mime_files(bundle):
+                self._schedule_update()
+        except EnvironmentError:
+            logging.exception('Error while installing the MIME types of %r',
+                              bundle.get_path())
+
+    def _schedule_update(self):
+        if self._update_sid is None:
+            self._update_sid = gobject.timeout_add(_MIME_UPDATE_DELAY,
+                                                   self.__update_cb)
+
+    def __update_cb(self):
+        self._update_sid = None
+        if self._update_pid is not None:
+            # Run again when the current rebuild is done
+            self._update_again = True
+            return False
+
+        try:
+            self._update_pid = gobject.spawn_async(
+                    ['update-mime-database', bundleinstall.get_mime_dir()],
+                    flags=gobject.SPAWN_SEARCH_PATH |
+                          gobject.SPAWN_DO_NOT_REAP_CHILD)[0]
+        except gobject.GError:
+            logging.exception('Error while updating the MIME database')
+            return False
+
+        gobject.child_watch_add(self._update_pid, self.__update_done_cb)
+        return False
+
+    def __update_done_cb(self, pid, condition):
+        self._update_pid = None
+        if not os.WIFEXITED(condition) or os.WEXITSTATUS(condition) != 0:
+            logging.error('update-mime-database failed: %r', condition)
+        if self._update_again:
+            self._update_again = False
+            self._schedule_update()
+
 
 class BundleRegistry(gobject.GObject):
     """Tracks the available activity bundles"""
@@ -44,6 +329,8 @@ class BundleRegistry(gobject.GObject):
     __gsignals__ = {
         'bundle-added': (gobject.SIGNAL_RUN_FIRST, gobject.TYPE_NONE,
                          ([gobject.TYPE_PYOBJECT])),
+        'bundles-added': (gobject.SIGNAL_RUN_FIRST, gobject.TYPE_NONE,
+                          ([gobject.TYPE_PYOBJECT])),
         'bundle-removed': (gobject.SIGNAL_RUN_FIRST, gobject.TYPE_NONE,
                            ([gobject.TYPE_PYOBJECT])),
         'bundle-changed': (gobject.SIGNAL_RUN_FIRST, gobject.TYPE_NONE,
@@ -57,8 +344,23 @@ class BundleRegistry(gobject.GObject):
         self._mime_defaults = self._load_mime_defaults()
 
         self._bundles = []
+        # indexes of self._bundles, see _index_bundle()
+        self._bundles_by_id = {}
+        self._bundles_by_version = {}
+        self._bundles_by_path = {}
+        # bundles for each MIME type, built on first use
+        self._mime_index = None
+        # results of get_activities_for_type()
+        self._activities_for_type = {}
         # hold a reference to the monitors so they don't get disposed
         self._gio_monitors = []
+        # bundle paths changed since the last time the monitors were
+        # processed, with the times they failed to load and the last
+        # fingerprint of their files, see _get_tree_fingerprint()
+        self._pending_bundle_paths = {}
+        self._monitor_sid = None
+        self._cache = _RegistryCache()
+        self._mime_installer = _MimeInstaller()
 
         user_path = env.get_user_activities_path()
         for activity_dir in [user_path, config.activities_path]:
@@ -68,8 +370,11 @@ class BundleRegistry(gobject.GObject):
             monitor.connect('changed', self.__file_monitor_changed_cb)
             self._gio_monitors.append(monitor)
 
+        self._cache.write()
+
         self._last_defaults_mtime = -1
         self._favorite_bundles = {}
+        self._favorites_write_sid = None
 
         client = gconf.client_get_default()
         self._protected_activities = client.get_list(
@@ -86,14 +391,74 @@ class BundleRegistry(gobject.GObject):
 
         self._merge_default_favorites()
 
+        mime_registry = mimeregistry.get_registry()
+        mime_registry.connect('defaults-changed',
+                              self.__mime_defaults_changed_cb)
+
+    def __mime_defaults_changed_cb(self, mime_registry):
+        self._activities_for_type = {}
+
     def __file_monitor_changed_cb(self, monitor, one_file, other_file,
                                   event_type):
         if not one_file.get_path().endswith('.activity'):
             return
-        if event_type == gio.FILE_MONITOR_EVENT_CREATED:
-            self.add_bundle(one_file.get_path(), install_mime_type=True)
-        elif event_type == gio.FILE_MONITOR_EVENT_DELETED:
-            self.remove_bundle(one_file.get_path())
+        if event_type not in (gio.FILE_MONITOR_EVENT_CREATED,
+                              gio.FILE_MONITOR_EVENT_DELETED):
+            return
+
+        # Unpacking a bundle takes a while, wait for the directories to
+        # settle and process all the changes together
+        bundle_path = one_file.get_path()
+        if bundle_path not in self._pending_bundle_paths:
+            self._pending_bundle_paths[bundle_path] = \
+                    (0, _get_tree_fingerprint(bundle_path))
+        self._schedule_monitor_changes()
+
+    def _schedule_monitor_changes(self):
+        if self._monitor_sid is not None:
+            gobject.source_remove(self._monitor_sid)
+        self._monitor_sid = gobject.timeout_add(
+                _MONITOR_DELAY, self.__process_monitor_changes_cb)
+
+    def __process_monitor_changes_cb(self):
+        self._monitor_sid = None
+        pending = self._pending_bundle_paths
+        self._pending_bundle_paths = {}
+
+        # Compare the registry with what is on disk now instead of
+        # replaying the events, a path may have changed several times
+        added_bundles = []
+        for bundle_path, (retries, fingerprint) in sorted(pending.items()):
+            if not os.path.isdir(bundle_path):
+                self.remove_bundle(bundle_path)
+                continue
+
+            # The monitors only see the bundle directory itself, compare
+            # its files with the last time to know if they are still
+            # being unpacked
+            new_fingerprint = _get_tree_fingerprint(bundle_path)
+            if new_fingerprint != fingerprint:
+                self._pending_bundle_paths[bundle_path] = \
+                        (retries, new_fingerprint)
+                continue
+
+            try:
+                bundle = self._load_bundle(bundle_path)
+            except MalformedBundleException:
+                if retries < _MONITOR_MAX_RETRIES:
+                    self._pending_bundle_paths[bundle_path] = \
+                            (retries + 1, new_fingerprint)
+                else:
+                    logging.exception('Error loading bundle %r', bundle_path)
+                continue
+
+            added_bundles.append(bundle)
+
+        self._register_bundles(added_bundles, install_mime_type=True)
+
+        if self._pending_bundle_paths:
+            self._schedule_monitor_changes()
+        return False
 
     def _load_mime_defaults(self):
         defaults = {}
@@ -102,9 +467,9 @@ class BundleRegistry(gobject.GObject):
         for line in f.readlines():
             line = line.strip()
             if line and not line.startswith('#'):
-                mime = line[:line.find(' ')]
+                mime_type = line[:line.find(' ')]
                 handler = line[line.rfind(' ') + 1:]
-                defaults[mime] = handler
+                defaults[mime_type] = handler
         f.close()
 
         return defaults
@@ -156,17 +521,15 @@ class BundleRegistry(gobject.GObject):
         if not default_activities:
             return
 
+        # Only the latest version of each bundle id is registered
         for bundle_id in default_activities:
-            max_version = '0'
-            for bundle in self._bundles:
-                if bundle.get_bundle_id() == bundle_id and \
-                        NormalizedVersion(max_version) < \
-                        NormalizedVersion(bundle.get_activity_version()):
-                    max_version = bundle.get_activity_version()
-
-            key = self._get_favorite_key(bundle_id, max_version)
-            if NormalizedVersion(max_version) > NormalizedVersion('0') and \
-                    key not in self._favorite_bundles:
+            bundle = self._bundles_by_id.get(bundle_id)
+            if bundle is None:
+                continue
+
+            key = self._get_favorite_key(bundle_id,
+                                         bundle.get_activity_version())
+            if key not in self._favorite_bundles:
                 self._favorite_bundles[key] = None
 
         logging.debug('After merging: %r', self._favorite_bundles)
@@ -175,10 +538,43 @@ class BundleRegistry(gobject.GObject):
 
     def get_bundle(self, bundle_id):
         """Returns an bundle given his service name"""
-        for bundle in self._bundles:
-            if bundle.get_bundle_id() == bundle_id:
-                return bundle
-        return None
+        return self._bundles_by_id.get(bundle_id)
+
+    def _index_bundle(self, bundle):
+        """Add a bundle to the lookup tables
+
+        Only one version of each bundle id is registered at a time.
+        """
+        bundle_id = bundle.get_bundle_id()
+        self._bundles_by_id[bundle_id] = bundle
+        self._bundles_by_version[
+                (bundle_id, bundle.get_activity_version())] = bundle
+        self._bundles_by_path[bundle.get_path()] = bundle
+
+        if self._mime_index is not None:
+            self._index_mime_types(bundle)
+        self._activities_for_type = {}
+
+    def _unindex_bundle(self, bundle):
+        bundle_id = bundle.get_bundle_id()
+        if self._bundles_by_id.get(bundle_id) is bundle:
+            del self._bundles_by_id[bundle_id]
+        self._bundles_by_version.pop(
+                (bundle_id, bundle.get_activity_version()), None)
+        self._bundles_by_path.pop(bundle.get_path(), None)
+
+        if self._mime_index is not None:
+            for mime_type in bundle.get_mime_types() or []:
+                bundles = self._mime_index.get(mime_type, [])
+                if bundle in bundles:
+                    bundles.remove(bundle)
+        self._activities_for_type = {}
+
+    def _index_mime_types(self, bundle):
+        for mime_type in bundle.get_mime_types() or []:
+            bundles = self._mime_index.setdefault(mime_type, [])
+            if bundle not in bundles:
+                bundles.append(bundle)
 
     def __iter__(self):
         return self._bundles.__iter__()
@@ -191,17 +587,21 @@ class BundleRegistry(gobject.GObject):
             return
 
         # Sort by mtime to ensure a stable activity order
-        bundles = {}
-        for f in os.listdir(path):
-            if not f.endswith('.activity'):
-                continue
-            try:
-                bundle_dir = os.path.join(path, f)
-                if os.path.isdir(bundle_dir):
-                    bundles[bundle_dir] = os.stat(bundle_dir).st_mtime
-            except Exception:
-                logging.exception('Error while processing installed activity'
-                                  ' bundle %s:', bundle_dir)
+        mtime = os.stat(path).st_mtime
+        bundles = self._cache.get_directory(path, mtime)
+        if bundles is None:
+            bundles = {}
+            for f in os.listdir(path):
+                if not f.endswith('.activity'):
+                    continue
+                try:
+                    bundle_dir = os.path.join(path, f)
+                    if os.path.isdir(bundle_dir):
+                        bundles[bundle_dir] = os.stat(bundle_dir).st_mtime
+                except Exception:
+                    logging.exception('Error while processing installed'
+                                      ' activity bundle %s:', bundle_dir)
+            self._cache.set_directory(path, mtime, bundles)
 
         bundle_dirs = bundles.keys()
         bundle_dirs.sort(lambda d1, d2: cmp(bundles[d1], bundles[d2]))
@@ -215,6 +615,7 @@ class BundleRegistry(gobject.GObject):
 
     def add_bundle(self, bundle_path, install_mime_type=False):
         bundle = self._add_bundle(bundle_path, install_mime_type)
+        self._cache.write()
         if bundle is not None:
             self._set_bundle_favorite(bundle.get_bundle_id(),
                                       bundle.get_activity_version(),
@@ -224,22 +625,48 @@ class BundleRegistry(gobject.GObject):
         else:
             return False
 
+    def _load_bundle(self, bundle_path):
+        """Return the bundle at bundle_path, from the cache if possible"""
+        try:
+            info_path = os.path.join(bundle_path, 'activity', 'activity.info')
+            mtimes = [os.stat(bundle_path).st_mtime,
+                      os.stat(info_path).st_mtime]
+        except OSError:
+            # Let ActivityBundle report what is wrong with it
+            return _BundleInfo(bundle_path,
+                               _get_bundle_fields(ActivityBundle(bundle_path)))
+
+        fields = self._cache.get_bundle(bundle_path, mtimes)
+        if fields is None:
+            # The ActivityBundle is dropped once the fields are copied,
+            # it is loaded again only when needed.
+            fields = _get_bundle_fields(ActivityBundle(bundle_path))
+            self._cache.set_bundle(bundle_path, mtimes, fields)
+        return _BundleInfo(bundle_path, fields)
+
     def _add_bundle(self, bundle_path, install_mime_type=False):
         logging.debug('STARTUP: Adding bundle %r', bundle_path)
         try:
-            bundle = ActivityBundle(bundle_path)
-            if install_mime_type:
-                bundle.install_mime_type(bundle_path)
+            bundle = self._load_bundle(bundle_path)
         except MalformedBundleException:
             logging.exception('Error loading bundle %r', bundle_path)
             return None
+        return self._add_loaded_bundle(bundle, install_mime_type)
+
+    def _add_loaded_bundle(self, bundle, install_mime_type=False):
+        if install_mime_type:
+            try:
+                self._mime_installer.install(bundle)
+            except MalformedBundleException:
+                logging.exception('Error loading bundle %r',
+                                  bundle.get_path())
+                return None
 
         bundle_id = bundle.get_bundle_id()
         installed = self.get_bundle(bundle_id)
 
         if installed is not None:
-            if NormalizedVersion(installed.get_activity_version()) >= \
-                    NormalizedVersion(bundle.get_activity_version()):
+            if installed.get_version_key() >= bundle.get_version_key():
                 logging.debug('Skip old version for %s', bundle_id)
                 return None
             else:
@@ -247,32 +674,58 @@ class BundleRegistry(gobject.GObject):
                 self.remove_bundle(installed.get_path())
 
         self._bundles.append(bundle)
+        self._index_bundle(bundle)
         return bundle
 
     def remove_bundle(self, bundle_path):
-        for bundle in self._bundles:
-            if bundle.get_path() == bundle_path:
-                self._bundles.remove(bundle)
-                self.emit('bundle-removed', bundle)
-                return True
-        return False
+        bundle = self._bundles_by_path.get(bundle_path)
+        if bundle is None:
+            return False
+
+        self._bundles.remove(bundle)
+        self._unindex_bundle(bundle)
+        self._cache.remove_bundle(bundle_path)
+        self._cache.write()
+        self.emit('bundle-removed', bundle)
+        return True
+
+    def get_activities_for_type(self, mime_type, include_parents=False):
+        """Returns the bundles that handle mime_type, preferred first
+
+        With include_parents, the handlers of the parent types of
+        mime_type are returned when no bundle handles it directly.
+        """
+        key = (mime_type, include_parents)
+        if key not in self._activities_for_type:
+            result = self._get_activities_for_type(mime_type)
+            if include_parents and not result:
+                for parent_mime in mime.get_mime_parents(mime_type):
+                    for bundle in self._get_activities_for_type(parent_mime):
+                        if bundle not in result:
+                            result.append(bundle)
+            self._activities_for_type[key] = result
+        return self._activities_for_type[key][:]
+
+    def _get_activities_for_type(self, mime_type):
+        if self._mime_index is None:
+            self._mime_index = {}
+            for bundle in self._bundles:
+                self._index_mime_types(bundle)
 
-    def get_activities_for_type(self, mime_type):
         result = []
 
-        mime = mimeregistry.get_registry()
-        default_bundle_id = mime.get_default_activity(mime_type)
+        mime_registry = mimeregistry.get_registry()
+        default_bundle_id = mime_registry.get_default_activity(mime_type)
         default_bundle = None
 
-        for bundle in self._bundles:
-            if mime_type in (bundle.get_mime_types() or []):
-                if bundle.get_bundle_id() == default_bundle_id:
-                    default_bundle = bundle
-                elif self.get_default_for_type(mime_type) == \
-                        bundle.get_bundle_id():
-                    result.insert(0, bundle)
-                else:
-                    result.append(bundle)
+        for bundle in self._mime_index.get(mime_type, []):
+            if bundle.get_bundle_id() == default_bundle_id:
+                default_bundle = bundle
+            elif self.get_default_for_type(mime_type) == \
+                    bundle.get_bundle_id():
+                result.insert(0, bundle)
+            else:
+                result.append(bundle)
 
         if default_bundle is not None:
             result.insert(0, default_bundle)
@@ -283,12 +736,11 @@ class BundleRegistry(gobject.GObject):
         return self._mime_defaults.get(mime_type)
 
     def _find_bundle(self, bundle_id, version):
-        for bundle in self._bundles:
-            if bundle.get_bundle_id() == bundle_id and \
-                    bundle.get_activity_version() == version:
-                return bundle
-        raise ValueError('No bundle %r with version %r exists.' % \
-                (bundle_id, version))
+        bundle = self._bundles_by_version.get((bundle_id, version))
+        if bundle is None:
+            raise ValueError('No bundle %r with version %r exists.' % \
+                    (bundle_id, version))
+        return bundle
 
     def set_bundle_favorite(self, bundle_id, version, favorite):
         changed = self._set_bundle_favorite(bundle_id, version, favorite)
@@ -346,10 +798,31 @@ class BundleRegistry(gobject.GObject):
             return tuple(self._favorite_bundles[key]['position'])
 
     def _write_favorites_file(self):
+        """Schedule saving the favorites, changes in a row are saved once"""
+        if self._favorites_write_sid is None:
+            self._favorites_write_sid = gobject.timeout_add(
+                    _FAVORITES_WRITE_DELAY, self.__write_favorites_cb)
+
+    def __write_favorites_cb(self):
+        self._favorites_write_sid = None
+        self._write_favorites_now()
+        return False
+
+    def flush_favorites(self):
+        """Save pending favorite changes right away"""
+        if self._favorites_write_sid is not None:
+            gobject.source_remove(self._favorites_write_sid)
+            self._favorites_write_sid = None
+            self._write_favorites_now()
+
+    def _write_favorites_now(self):
         path = env.get_profile_path('favorite_activities')
         favorites_data = {'defaults-mtime': self._last_defaults_mtime,
                           'favorites': self._favorite_bundles}
-        simplejson.dump(favorites_data, open(path, 'w'), indent=1)
+        try:
+            _write_json_atomically(path, favorites_data, indent=1)
+        except EnvironmentError:
+            logging.exception('Error while writing favorite_activities.')
 
     def is_installed(self, bundle):
         # TODO treat ContentBundle in special way
@@ -358,26 +831,19 @@ class BundleRegistry(gobject.GObject):
                 isinstance(bundle, JournalEntryBundle):
             return bundle.is_installed()
 
-        for installed_bundle in self._bundles:
-            if bundle.get_bundle_id() == installed_bundle.get_bundle_id() and \
-                    NormalizedVersion(bundle.get_activity_version()) == \
-                    NormalizedVersion(installed_bundle.get_activity_version()):
-                return True
-        return False
+        installed_bundle = self.get_bundle(bundle.get_bundle_id())
+        return installed_bundle is not None and \
+                _get_version_key(bundle) == installed_bundle.get_version_key()
 
     def install(self, bundle, uid=None, force_downgrade=False):
         activities_path = env.get_user_activities_path()
 
-        for installed_bundle in self._bundles:
-            if bundle.get_bundle_id() == installed_bundle.get_bundle_id() and \
-                    NormalizedVersion(bundle.get_activity_version()) <= \
-                    NormalizedVersion(installed_bundle.get_activity_version()):
-                if not force_downgrade:
-                    raise AlreadyInstalledException
-                else:
-                    self.uninstall(installed_bundle, force=True)
-            elif bundle.get_bundle_id() == installed_bundle.get_bundle_id():
-                self.uninstall(installed_bundle, force=True)
+        installed_bundle = self.get_bundle(bundle.get_bundle_id())
+        if installed_bundle is not None:
+            if _get_version_key(bundle) <= \
+                    installed_bundle.get_version_key() and not force_downgrade:
+                raise AlreadyInstalledException
+            self.uninstall(installed_bundle, force=True)
 
         install_dir = env.get_user_activities_path()
         if isinstance(bundle, JournalEntryBundle):
@@ -385,16 +851,34 @@ class BundleRegistry(gobject.GObject):
         elif isinstance(bundle, ContentBundle):
             install_path = bundle.install()
         else:
-            install_path = bundle.install(install_dir)
+            # The MIME database is updated later, see _MimeInstaller
+            install_path = bundleinstall.unpack_bundle(bundle.get_path(),
+                                                       install_dir)
 
         # TODO treat ContentBundle in special way
         # needs rethinking while fixing ContentBundle support
         if isinstance(bundle, ContentBundle) or \
                 isinstance(bundle, JournalEntryBundle):
             pass
-        elif not self.add_bundle(install_path):
+        elif not self.add_bundle(install_path, install_mime_type=True):
             raise RegistrationException
 
+    def _register_bundles(self, bundles, install_mime_type=False):
+        """Add several loaded bundles, notifying them all at once"""
+        added = []
+        for bundle in bundles:
+            bundle = self._add_loaded_bundle(bundle, install_mime_type)
+            if bundle is not None:
+                self._set_bundle_favorite(bundle.get_bundle_id(),
+                                          bundle.get_activity_version(),
+                                          True)
+                added.append(bundle)
+        self._cache.write()
+
+        if added:
+            self.emit('bundles-added', added)
+        return added
+
     def uninstall(self, bundle, force=False, delete_profile=False):
         # TODO treat ContentBundle in special way
         # needs rethinking while fixing ContentBundle support
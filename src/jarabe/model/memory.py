@@ -0,0 +1,298 @@
+# Copyright (C) 2011 One Laptop Per Child
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Free memory by closing or suspending background activities
+
+When the free memory of the system goes under a threshold, the least
+recently used activity that is not in the foreground is stopped until
+the user switches to it again or, if configured so, asked to close,
+which makes it save its state to the Journal.
+"""
+
+import os
+import errno
+import signal
+import logging
+import time
+from collections import deque
+
+import gconf
+import gobject
+import gtk
+
+from jarabe.model import shell
+
+
+_GCONF_DIR = '/desktop/sugar/memory'
+_ACTION_KEY = _GCONF_DIR + '/action'
+_MIN_FREE_KEY = _GCONF_DIR + '/min_free'
+_INTERVAL_KEY = _GCONF_DIR + '/check_interval'
+
+ACTION_NONE = 'none'
+ACTION_CLOSE = 'close'
+ACTION_SUSPEND = 'suspend'
+
+_DEFAULT_MIN_FREE = 32
+_DEFAULT_INTERVAL = 10
+
+# Seconds to give a closing activity before acting again
+_ACTION_COOLDOWN = 30
+
+# Number of actions kept in the log
+_ACTION_LOG_SIZE = 50
+
+_instance = None
+
+
+def get_free_memory():
+    """Returns the memory available to new allocations, in kB"""
+    meminfo = {}
+    try:
+        f = open('/proc/meminfo')
+        try:
+            for line in f:
+                name, value = line.split(':', 1)
+                meminfo[name] = int(value.split()[0])
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        logging.exception('Error while reading /proc/meminfo')
+        return None
+
+    if 'MemAvailable' in meminfo:
+        return meminfo['MemAvailable']
+    return meminfo.get('MemFree', 0) + meminfo.get('Buffers', 0) + \
+            meminfo.get('Cached', 0)
+
+
+def get_process_rss(pid):
+    """Returns the resident memory of the process, in kB"""
+    try:
+        f = open('/proc/%d/status' % pid)
+        try:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        logging.debug('Cannot read the memory usage of process %r', pid)
+    return None
+
+
+class MemoryManager(gobject.GObject):
+    """Watch the free memory and reclaim it from background activities
+
+    The policy is read from gconf: the action to take (none, close or
+    suspend), the minimum free memory in MB and the number of seconds
+    between checks.
+    """
+
+    __gsignals__ = {
+        'action-taken': (gobject.SIGNAL_RUN_FIRST, gobject.TYPE_NONE,
+                         ([gobject.TYPE_PYOBJECT])),
+    }
+
+    def __init__(self):
+        gobject.GObject.__init__(self)
+
+        self._client = gconf.client_get_default()
+        self._client.add_dir(_GCONF_DIR, gconf.CLIENT_PRELOAD_NONE)
+        self._client.notify_add(_GCONF_DIR, self.__policy_changed_cb)
+
+        self._last_used = {}
+        self._suspended = set()
+        self._last_action_time = 0
+        self._action_log = deque(maxlen=_ACTION_LOG_SIZE)
+        self._check_sid = None
+
+        self._shell_model = shell.get_model()
+        self._shell_model.connect('active-activity-changed',
+                                  self.__active_activity_changed_cb)
+        self._shell_model.connect('activity-removed',
+                                  self.__activity_removed_cb)
+        active_activity = self._shell_model.get_active_activity()
+        if active_activity is not None:
+            self._last_used[active_activity] = time.time()
+
+        self._load_policy()
+
+    def _load_policy(self):
+        # Closing is opt-in, an activity may not save all of its work
+        self._action = self._client.get_string(_ACTION_KEY) or ACTION_SUSPEND
+        if self._action not in (ACTION_NONE, ACTION_CLOSE, ACTION_SUSPEND):
+            logging.error('Unknown memory action %r', self._action)
+            self._action = ACTION_NONE
+
+        self._min_free = self._get_int(_MIN_FREE_KEY, _DEFAULT_MIN_FREE)
+        interval = self._get_int(_INTERVAL_KEY, _DEFAULT_INTERVAL)
+
+        if self._check_sid is not None:
+            gobject.source_remove(self._check_sid)
+            self._check_sid = None
+        if self._action != ACTION_SUSPEND:
+            self.resume_all()
+        if self._action != ACTION_NONE:
+            self._check_sid = gobject.timeout_add_seconds(interval,
+                                                          self.__check_cb)
+
+    def _get_int(self, key, default):
+        value = self._client.get_without_default(key)
+        if value is None or value.type != gconf.VALUE_INT or \
+                value.get_int() <= 0:
+            return default
+        return value.get_int()
+
+    def __policy_changed_cb(self, client, timestamp, entry, *extra):
+        self._load_policy()
+
+    def __active_activity_changed_cb(self, model, home_activity):
+        if home_activity is None:
+            return
+        self._last_used[home_activity] = time.time()
+        if home_activity in self._suspended:
+            self._resume(home_activity)
+
+    def __activity_removed_cb(self, model, home_activity):
+        self._last_used.pop(home_activity, None)
+        self._suspended.discard(home_activity)
+
+    def __check_cb(self):
+        self.check()
+        return True
+
+    def check(self):
+        """Free memory now if it is under the threshold"""
+        self._forget_exited()
+
+        free = get_free_memory()
+        if free is None or free >= self._min_free * 1024:
+            return
+        if time.time() - self._last_action_time < _ACTION_COOLDOWN:
+            return
+
+        home_activity = self._get_least_recently_used()
+        if home_activity is None:
+            logging.warning('Low on memory (%d kB free) but no activity'
+                            ' can be stopped', free)
+            return
+
+        rss = get_process_rss(home_activity.get_pid())
+        if self._action == ACTION_SUSPEND:
+            self._suspend(home_activity)
+        else:
+            if home_activity in self._suspended:
+                # A stopped activity could not answer the close request
+                self._resume(home_activity)
+            home_activity.get_window().close(gtk.get_current_event_time())
+
+        self._last_action_time = time.time()
+        self._log_action(self._action, home_activity, free, rss)
+
+    def _get_least_recently_used(self):
+        active_activity = self._shell_model.get_active_activity()
+        candidates = []
+        for home_activity in self._shell_model:
+            if home_activity is active_activity or \
+                    (self._action == ACTION_SUSPEND and
+                     home_activity in self._suspended) or \
+                    home_activity.is_journal() or \
+                    home_activity.get_launch_status() != \
+                        shell.Activity.LAUNCHED or \
+                    home_activity.get_pid() is None:
+                continue
+            last_used = self._last_used.get(home_activity,
+                                            home_activity.get_launch_time())
+            candidates.append((last_used, home_activity))
+
+        if not candidates:
+            return None
+        return min(candidates)[1]
+
+    def _suspend(self, home_activity):
+        try:
+            os.kill(home_activity.get_pid(), signal.SIGSTOP)
+        except OSError:
+            logging.exception('Error while suspending %r',
+                              home_activity.get_activity_id())
+            return
+        self._suspended.add(home_activity)
+
+    def _resume(self, home_activity):
+        self._suspended.discard(home_activity)
+        try:
+            os.kill(home_activity.get_pid(), signal.SIGCONT)
+        except OSError, e:
+            if e.errno != errno.ESRCH:
+                logging.exception('Error while resuming %r',
+                                  home_activity.get_activity_id())
+            return
+        self._log_action('resume', home_activity, get_free_memory(),
+                         get_process_rss(home_activity.get_pid()))
+
+    def resume_all(self):
+        """Let all the suspended activities run again"""
+        for home_activity in list(self._suspended):
+            self._resume(home_activity)
+
+    def _forget_exited(self):
+        # The process of a suspended activity can be killed while its
+        # window is still around
+        for home_activity in list(self._suspended):
+            try:
+                os.kill(home_activity.get_pid(), 0)
+            except OSError, e:
+                if e.errno == errno.ESRCH:
+                    self._suspended.discard(home_activity)
+
+    def _log_action(self, action, home_activity, free, rss):
+        entry = {'time': time.time(),
+                 'action': action,
+                 'bundle_id': home_activity.get_type(),
+                 'activity_id': home_activity.get_activity_id(),
+                 'free': free,
+                 'rss': rss}
+        logging.info('Memory manager: %s %s (%s), %s kB free, %s kB used',
+                     action, entry['bundle_id'], entry['activity_id'],
+                     free, rss)
+        self._action_log.append(entry)
+        self.emit('action-taken', entry)
+
+    def get_action_log(self):
+        """Returns the last actions taken, oldest first
+
+        Each one is a dictionary with the time, the action, the bundle_id
+        and activity_id of the activity, the free system memory and the
+        memory used by the activity, both in kB.
+        """
+        return list(self._action_log)
+
+
+def get_manager():
+    global _instance
+    if _instance is None:
+        _instance = MemoryManager()
+    return _instance
+
+
+def init():
+    get_manager()
+
+
+def resume_all():
+    """Let the suspended activities run, so they can be closed"""
+    if _instance is not None:
+        _instance.resume_all()
@@ -17,6 +17,7 @@
 import re
 
 import gconf
+import gobject
 
 
 _DEFAULTS_KEY = '/desktop/sugar/journal/defaults'
@@ -25,14 +26,32 @@ _GCONF_INVALID_CHARS = re.compile('[^a-zA-Z0-9-_/.]')
 _instance = None
 
 
-class MimeRegistry(object):
+class MimeRegistry(gobject.GObject):
+
+    __gsignals__ = {
+        'defaults-changed': (gobject.SIGNAL_RUN_FIRST, gobject.TYPE_NONE,
+                             ([])),
+    }
 
     def __init__(self):
+        gobject.GObject.__init__(self)
+
         # TODO move here all mime_type related code from jarabe modules
         self._gconf = gconf.client_get_default()
+        self._defaults = {}
+
+        self._gconf.add_dir(_DEFAULTS_KEY, gconf.CLIENT_PRELOAD_NONE)
+        self._gconf.notify_add(_DEFAULTS_KEY, self.__defaults_changed_cb)
+
+    def __defaults_changed_cb(self, client, timestamp, entry, *extra):
+        self._defaults = {}
+        self.emit('defaults-changed')
 
     def get_default_activity(self, mime_type):
-        return self._gconf.get_string(_key_name(mime_type))
+        if mime_type not in self._defaults:
+            self._defaults[mime_type] = \
+                    self._gconf.get_string(_key_name(mime_type))
+        return self._defaults[mime_type]
 
     def set_default_activity(self, mime_type, bundle_id):
         self._gconf.set_string(_key_name(mime_type), bundle_id)
@@ -24,6 +24,9 @@ import logging
 from sugar import session
 from sugar import env
 
+from jarabe.model import bundleregistry
+from jarabe.model import memory
+
 
 _session_manager = None
 
@@ -53,7 +56,15 @@ class SessionManager(session.SessionManager):
         self._logout_mode = self.MODE_REBOOT
         self.initiate_shutdown()
 
+    def initiate_shutdown(self):
+        # Stopped activities would never answer the request to close
+        memory.resume_all()
+        session.SessionManager.initiate_shutdown(self)
+
     def shutdown_completed(self):
+        bundleregistry.get_registry().flush_favorites()
+        memory.resume_all()
+
         if env.is_emulator():
             self._close_emulator()
         elif self._logout_mode != self.MODE_LOGOUT:
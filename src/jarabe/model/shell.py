@@ -17,6 +17,7 @@
 
 import logging
 import time
+from collections import deque
 
 import gconf
 import wnck
@@ -34,6 +35,9 @@ _SERVICE_NAME = 'org.laptop.Activity'
 _SERVICE_PATH = '/org/laptop/Activity'
 _SERVICE_INTERFACE = 'org.laptop.Activity'
 
+# Number of finished launches whose timings are kept
+_LAUNCH_TIMINGS_SIZE = 100
+
 _model = None
 
 
@@ -109,6 +113,10 @@ class Activity(gobject.GObject):
             raise ValueError('window must be valid')
         self._windows.append(window)
 
+    def get_xids(self):
+        """Get the X window ids of the windows stack"""
+        return [window.get_xid() for window in self._windows]
+
     def remove_window_by_xid(self, xid):
         """Remove a window from the windows stack."""
         for wnd in self._windows:
@@ -277,6 +285,8 @@ class Activity(gobject.GObject):
             elif not old and new:
                 logging.debug('Activity._name_owner_changed_cb: ' \
                         'activity %s started up', name)
+                get_model().record_launch_event(self._activity_id,
+                                                'service_appeared')
                 self._retrieve_service()
                 self.set_active(True)
 
@@ -364,10 +374,19 @@ class ShellModel(gobject.GObject):
         self._zoom_level = self.ZOOM_HOME
         self._current_activity = None
         self._activities = []
+        # indexes of self._activities
+        self._activities_by_id = {}
+        self._activities_by_xid = {}
+        # self._activities as a ring, for tabbing
+        self._next_activities = {}
+        self._previous_activities = {}
         self._shared_activities = {}
         self._active_activity = None
         self._tabbing_activity = None
         self._launchers = {}
+        # timings of the launches in progress, by activity id
+        self._launch_timings = {}
+        self._finished_launch_timings = deque(maxlen=_LAUNCH_TIMINGS_SIZE)
 
         self._screen.toggle_showing_desktop(True)
 
@@ -428,38 +447,26 @@ class ShellModel(gobject.GObject):
 
     zoom_level = property(_get_zoom_level)
 
-    def _get_activities_with_window(self):
-        ret = []
-        for i in self._activities:
-            if i.get_window() is not None:
-                ret.append(i)
-        return ret
+    def _get_neighbour_activity(self, current, neighbours):
+        """Follow the ring to the closest activity that has a window"""
+        if current not in neighbours:
+            return None
+
+        activity = neighbours[current]
+        while activity.get_window() is None and activity is not current:
+            activity = neighbours[activity]
+        return activity
 
     def get_previous_activity(self, current=None):
         if not current:
             current = self._active_activity
-
-        activities = self._get_activities_with_window()
-        i = activities.index(current)
-        if len(activities) == 0:
-            return None
-        elif i - 1 >= 0:
-            return activities[i - 1]
-        else:
-            return activities[len(activities) - 1]
+        return self._get_neighbour_activity(current,
+                                            self._previous_activities)
 
     def get_next_activity(self, current=None):
         if not current:
             current = self._active_activity
-
-        activities = self._get_activities_with_window()
-        i = activities.index(current)
-        if len(activities) == 0:
-            return None
-        elif i + 1 < len(activities):
-            return activities[i + 1]
-        else:
-            return activities[0]
+        return self._get_neighbour_activity(current, self._next_activities)
 
     def get_active_activity(self):
         """Returns the activity that the user is currently working in"""
@@ -551,6 +558,10 @@ class ShellModel(gobject.GObject):
             else:
                 logging.debug('window registered for %s', activity_id)
                 home_activity.add_window(window)
+                self._activities_by_xid[window.get_xid()] = home_activity
+
+            if wm.get_sugar_window_type(window) != 'launcher':
+                self.record_launch_event(activity_id, 'window_mapped')
 
             if wm.get_sugar_window_type(window) != 'launcher' \
                     and home_activity.get_launch_status() == Activity.LAUNCHING:
@@ -558,6 +569,7 @@ class ShellModel(gobject.GObject):
                 startup_time = time.time() - home_activity.get_launch_time()
                 logging.debug('%s launched in %f seconds.',
                               activity_id, startup_time)
+                self._finish_launch_timing(activity_id, 'completed')
 
             if self._active_activity is None:
                 self._set_active_activity(home_activity)
@@ -568,22 +580,17 @@ class ShellModel(gobject.GObject):
             activity = self._get_activity_by_xid(xid)
             if activity is not None:
                 activity.remove_window_by_xid(xid)
+                del self._activities_by_xid[xid]
                 if activity.get_window() is None:
                     logging.debug('last window gone - remove activity %s',
                                   activity)
                     self._remove_activity(activity)
 
     def _get_activity_by_xid(self, xid):
-        for home_activity in self._activities:
-            if home_activity.has_xid(xid):
-                return home_activity
-        return None
+        return self._activities_by_xid.get(xid)
 
     def get_activity_by_id(self, activity_id):
-        for home_activity in self._activities:
-            if home_activity.get_activity_id() == activity_id:
-                return home_activity
-        return None
+        return self._activities_by_id.get(activity_id)
 
     def _active_window_changed_cb(self, screen, previous_window=None):
         window = screen.get_active_window()
@@ -601,7 +608,25 @@ class ShellModel(gobject.GObject):
         self._update_zoom_level(window)
 
     def _add_activity(self, home_activity):
+        if self._activities:
+            first = self._activities[0]
+            last = self._previous_activities[first]
+        else:
+            first = last = home_activity
+        self._next_activities[last] = home_activity
+        self._previous_activities[home_activity] = last
+        self._next_activities[home_activity] = first
+        self._previous_activities[first] = home_activity
+
         self._activities.append(home_activity)
+
+        activity_id = home_activity.get_activity_id()
+        if activity_id and activity_id not in self._activities_by_id:
+            self._activities_by_id[activity_id] = home_activity
+        xid = home_activity.get_xid()
+        if xid is not None:
+            self._activities_by_xid[xid] = home_activity
+
         self.emit('activity-added', home_activity)
 
     def _remove_activity(self, home_activity):
@@ -620,6 +645,20 @@ class ShellModel(gobject.GObject):
         self.emit('activity-removed', home_activity)
         self._activities.remove(home_activity)
 
+        previous = self._previous_activities.pop(home_activity)
+        next_ = self._next_activities.pop(home_activity)
+        if home_activity is not previous:
+            self._next_activities[previous] = next_
+            self._previous_activities[next_] = previous
+
+        activity_id = home_activity.get_activity_id()
+        if self._activities_by_id.get(activity_id) is home_activity:
+            del self._activities_by_id[activity_id]
+        for xid in home_activity.get_xids():
+            if self._activities_by_xid.get(xid) is home_activity:
+                del self._activities_by_xid[xid]
+        self._launch_timings.pop(home_activity.get_activity_id(), None)
+
     def notify_launch(self, activity_id, service_name):
         registry = get_registry()
         activity_info = registry.get_bundle(service_name)
@@ -627,6 +666,13 @@ class ShellModel(gobject.GObject):
             raise ValueError("Activity service name '%s'" \
                              " was not found in the bundle registry."
                              % service_name)
+        self._launch_timings[activity_id] = {
+                'bundle_id': activity_info.get_bundle_id(),
+                'activity_version': activity_info.get_activity_version(),
+                'activity_id': activity_id,
+                'start_time': time.time(),
+                }
+
         color = self._shared_activities.get(activity_id, None)
         home_activity = Activity(activity_info, activity_id, color)
         self._add_activity(home_activity)
@@ -647,6 +693,7 @@ class ShellModel(gobject.GObject):
                 home_activity.get_type())
             if self.get_launcher(activity_id) is not None:
                 self.emit('launch-failed', home_activity)
+                self._finish_launch_timing(activity_id, 'failed')
             else:
                 # activity sent failure notification after closing launcher
                 self._remove_activity(home_activity)
@@ -667,6 +714,34 @@ class ShellModel(gobject.GObject):
             self.notify_launch_failed(activity_id)
         return False
 
+    def record_launch_event(self, activity_id, event):
+        """Note the time of a launch step of the activity
+
+        The time is stored in seconds since notify_launch(), only the
+        first occurrence of each event is kept.
+        """
+        timing = self._launch_timings.get(activity_id)
+        if timing is not None and event not in timing:
+            timing[event] = time.time() - timing['start_time']
+
+    def _finish_launch_timing(self, activity_id, result):
+        timing = self._launch_timings.pop(activity_id, None)
+        if timing is None:
+            return
+        timing[result] = time.time() - timing['start_time']
+        self._finished_launch_timings.append(timing)
+        logging.debug('Launch timing of %s: %r', timing['bundle_id'], timing)
+
+    def get_launch_timings(self):
+        """Returns the timings of the last finished launches, oldest first
+
+        Each one is a dictionary with the bundle_id, activity_version,
+        activity_id and start_time of the launch and, for the steps
+        that happened, the seconds it took to reach them:
+        service_appeared, window_mapped and completed or failed.
+        """
+        return [dict(timing) for timing in self._finished_launch_timings]
+
 
 def get_model():
     global _model
@@ -0,0 +1,162 @@
+# Copyright (C) 2011 One Laptop Per Child
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Launch Python activities by forking a warm interpreter
+
+Starting an activity with activityfactory runs a new Python process
+that imports gtk and the sugar modules again. The sugar-activity-zygote
+process has them imported already and forks itself into the activity,
+see start() and launch().
+"""
+
+import os
+import socket
+import logging
+
+import gobject
+import simplejson
+
+from sugar import env
+from sugar.activity import activityfactory
+from sugar.datastore import datastore
+
+from jarabe.model import shell
+
+
+_socket_path = None
+
+
+def start():
+    """Run the zygote process, activities launched afterwards use it"""
+    global _socket_path
+
+    socket_path = env.get_profile_path('activity-zygote')
+    try:
+        # Not reaped by glib so that the zygote stays our child and can
+        # tell when the shell is gone
+        pid = gobject.spawn_async(['sugar-activity-zygote', socket_path],
+                                  flags=gobject.SPAWN_SEARCH_PATH |
+                                        gobject.SPAWN_DO_NOT_REAP_CHILD)[0]
+    except gobject.GError:
+        logging.exception('Cannot start the activity zygote')
+        return
+    gobject.child_watch_add(pid, __zygote_exited_cb)
+    _socket_path = socket_path
+
+
+def __zygote_exited_cb(pid, condition):
+    global _socket_path
+    logging.error('The activity zygote exited with status %r', condition)
+    _socket_path = None
+
+
+def launch(bundle, activity_handle):
+    """Start the activity from the zygote
+
+    Returns False when the activity cannot be started this way, because
+    it is not a Python activity, it has to be isolated by rainbow or the
+    zygote is not running, and activityfactory must be used instead.
+    The journal entry of the activity is looked up first when only its
+    activity_id is known.
+    """
+    if _socket_path is None or os.path.exists('/etc/olpc-security'):
+        return False
+
+    command = bundle.get_command().split(' ')
+    if os.path.basename(command[0]) != 'sugar-activity':
+        return False
+
+    if activity_handle.activity_id is not None and \
+            activity_handle.object_id is None:
+        # Resume the journal entry of the activity if there is one, as
+        # activityfactory does
+        datastore.find({'activity_id': activity_handle.activity_id},
+                       properties=['uid'],
+                       reply_handler=lambda entries, total_count:
+                           __find_object_reply_cb(bundle, activity_handle,
+                                                  entries),
+                       error_handler=lambda error:
+                           __find_object_error_cb(bundle, activity_handle,
+                                                  error))
+        return True
+
+    return _send_request(bundle, activity_handle)
+
+
+def __find_object_reply_cb(bundle, activity_handle, entries):
+    if entries:
+        activity_handle.object_id = entries[0]['uid']
+    if not _send_request(bundle, activity_handle):
+        activityfactory.create(bundle, activity_handle)
+
+
+def __find_object_error_cb(bundle, activity_handle, error):
+    logging.error('Cannot find the journal entry of activity %s: %s',
+                  activity_handle.activity_id, error)
+    __find_object_reply_cb(bundle, activity_handle, [])
+
+
+def _send_request(bundle, activity_handle):
+    command = activityfactory.get_command(bundle, activity_handle.activity_id,
+                                          activity_handle.object_id,
+                                          activity_handle.uri,
+                                          activity_handle.invited)
+
+    log_path, log_file = activityfactory.open_log_file(bundle)
+    log_file.close()
+    request = {'command': [str(arg) for arg in command],
+               'environment': dict(activityfactory.get_environment(bundle)),
+               'cwd': str(bundle.get_path()),
+               'log_path': log_path}
+
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(_socket_path)
+        conn.sendall(simplejson.dumps(request) + '\n')
+        reply = simplejson.loads(conn.makefile().readline())
+    except (socket.error, ValueError):
+        logging.exception('Cannot launch %s from the zygote',
+                          bundle.get_bundle_id())
+        conn.close()
+        return False
+
+    logging.debug('Launched %s from the zygote, pid %d',
+                  bundle.get_bundle_id(), reply['pid'])
+    shell.get_model().notify_launch(activity_handle.activity_id,
+                                    bundle.get_bundle_id())
+
+    gobject.io_add_watch(conn, gobject.IO_IN | gobject.IO_HUP,
+                         __activity_exited_cb, activity_handle.activity_id)
+    return True
+
+
+def __activity_exited_cb(conn, condition, activity_id):
+    try:
+        status = simplejson.loads(conn.makefile().readline())['status']
+    except (socket.error, ValueError, KeyError):
+        logging.error('Lost track of activity %s', activity_id)
+        status = None
+    conn.close()
+
+    if status is not None and os.WIFEXITED(status) and \
+            os.WEXITSTATUS(status) == 0:
+        logging.debug('Activity %s exited normally', activity_id)
+    else:
+        logging.error('Activity %s exited with status %r', activity_id,
+                      status)
+        if shell.get_model().get_activity_by_id(activity_id) is not None:
+            shell.get_model().notify_launch_failed(activity_id)
+    return False
@@ -0,0 +1,160 @@
+# Copyright (C) 2011 One Laptop Per Child
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Unpack activity bundles and install their MIME types
+
+Does not depend on the shell, sugar-install-bundle uses it to unpack
+several bundles with a pool of worker processes. The MIME types of the
+bundles are linked into the user data directory, the MIME database has
+to be updated afterwards, see update_mime_database().
+"""
+
+import os
+import logging
+import multiprocessing
+import subprocess
+
+from sugar import env
+from sugar.bundle.activitybundle import ActivityBundle
+
+
+def get_mime_dir():
+    data_home = os.getenv('XDG_DATA_HOME',
+                          os.path.expanduser('~/.local/share'))
+    return os.path.join(data_home, 'mime')
+
+
+def get_mime_icons_dir():
+    data_home = os.getenv('XDG_DATA_HOME',
+                          os.path.expanduser('~/.local/share'))
+    return os.path.join(data_home, 'icons/sugar/scalable/mimetypes')
+
+
+def link_mime_files(bundle):
+    """Link the MIME types and icons of an installed bundle
+
+    Returns True when the MIME database needs to be updated.
+    """
+    bundle_path = bundle.get_path()
+    update_needed = False
+
+    mime_path = os.path.join(bundle_path, 'activity', 'mimetypes.xml')
+    if os.path.isfile(mime_path):
+        packages_dir = os.path.join(get_mime_dir(), 'packages')
+        _symlink(mime_path, os.path.join(packages_dir,
+                                         '%s.xml' % bundle.get_bundle_id()))
+        update_needed = True
+
+    icons_dir = get_mime_icons_dir()
+    for mime_type in bundle.get_mime_types() or []:
+        icon_base = os.path.join(bundle_path, 'activity',
+                                 mime_type.replace('/', '-'))
+        for icon_path in [icon_base + '.svg', icon_base + '.icon']:
+            if os.path.isfile(icon_path):
+                _symlink(icon_path,
+                         os.path.join(icons_dir, os.path.basename(icon_path)))
+
+    return update_needed
+
+
+def _symlink(src, dst):
+    if not os.path.isdir(os.path.dirname(dst)):
+        os.makedirs(os.path.dirname(dst))
+    if os.path.islink(dst):
+        os.unlink(dst)
+    elif os.path.exists(dst):
+        # Not ours, like a MIME type or icon installed by the system
+        logging.warning('Not replacing %r, it is not a symbolic link', dst)
+        return
+    os.symlink(src, dst)
+
+
+def update_mime_database():
+    """Rebuild the MIME database and wait for it"""
+    try:
+        status = subprocess.call(['update-mime-database', get_mime_dir()])
+    except OSError:
+        logging.exception('Error while updating the MIME database')
+        return
+    if status != 0:
+        logging.error('update-mime-database failed: %r', status)
+
+
+class _UnpackedBundle(ActivityBundle):
+    """An ActivityBundle whose MIME types are installed by the caller"""
+
+    def install_mime_type(self, install_path):
+        pass
+
+
+def unpack_bundle(bundle_path, install_dir=None):
+    """Install a .xo file without its MIME types
+
+    Returns the installation path, see link_mime_files() to install the
+    MIME types.
+    """
+    return _UnpackedBundle(bundle_path).install(install_dir)
+
+
+def _install_bundle_file(args):
+    bundle_path, install_dir = args
+    try:
+        return unpack_bundle(bundle_path, install_dir)
+    except Exception:
+        logging.exception('Error while installing bundle %r', bundle_path)
+        return None
+
+
+def install_bundle_files(bundle_paths, install_dir=None, processes=None):
+    """Unpack activity bundles using a pool of worker processes
+
+    The MIME database is updated once for all of them. Returns the
+    installation path of each bundle, None where it failed. The running
+    shell registers the bundles when it notices them.
+    """
+    if not bundle_paths:
+        return []
+    if install_dir is None:
+        install_dir = env.get_user_activities_path()
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(bundle_paths))
+
+    args = [(bundle_path, install_dir) for bundle_path in bundle_paths]
+    if processes < 2:
+        install_paths = map(_install_bundle_file, args)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            install_paths = pool.map(_install_bundle_file, args)
+        finally:
+            pool.close()
+            pool.join()
+
+    update_needed = False
+    for install_path in install_paths:
+        if install_path is None:
+            continue
+        try:
+            if link_mime_files(ActivityBundle(install_path)):
+                update_needed = True
+        except Exception:
+            logging.exception('Error while installing the MIME types of %r',
+                              install_path)
+    if update_needed:
+        update_mime_database()
+
+    return install_paths
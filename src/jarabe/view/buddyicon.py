@@ -18,6 +18,7 @@ from sugar.graphics.icon import CanvasIcon
 from sugar.graphics import style
 
 from jarabe.view.buddymenu import BuddyMenu
+from jarabe.view import iconcache
 
 _FILTERED_ALPHA = 0.33
 
@@ -63,3 +64,23 @@ class BuddyIcon(CanvasIcon):
         self._filtered = (self._buddy.get_nick().lower().find(query) == -1) \
                 and not self._buddy.is_owner()
         self._update_color()
+
+    def do_paint_below_children(self, cr, damaged_box):
+        # The renderings are shared by the buddies of the same colors
+        if not iconcache.paint(self, cr, icon_name='computer-xo',
+                               xo_color=self._buddy.get_color()):
+            CanvasIcon.do_paint_below_children(self, cr, damaged_box)
+
+    def do_get_content_width_request(self):
+        # CanvasIcon would render the icon in a buffer of its own to
+        # measure it, the size is known without that
+        size = self.props.size
+        if size is None:
+            return CanvasIcon.do_get_content_width_request(self)
+        return size, size
+
+    def do_get_content_height_request(self, for_width):
+        size = self.props.size
+        if size is None:
+            return CanvasIcon.do_get_content_height_request(self, for_width)
+        return size, size
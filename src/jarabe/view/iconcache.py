@@ -0,0 +1,81 @@
+# Copyright (C) 2011 One Laptop Per Child
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Icons rendered once and shared by the views
+
+The neighborhood can show hundreds of icons with the same name, colors
+and size, and the favorites layouts resize the same icons back and
+forth. get_surface() rasterizes each of them once and keeps the most
+recently used surfaces. The icons painted by paint() should take their
+size request from props.size, CanvasIcon renders them in a buffer of
+their own to measure them.
+"""
+
+from sugar.graphics import icon
+
+# Number of (icon, colors, size) whose surfaces are kept
+CACHE_SIZE = 150
+
+_surfaces = {}
+_keys = []
+
+
+def get_surface(icon_name=None, file_name=None, xo_color=None, size=None):
+    """Return the icon rendered at size, rendering it if needed"""
+    if xo_color is not None:
+        colors = (xo_color.get_stroke_color(), xo_color.get_fill_color())
+    else:
+        colors = (None, None)
+    key = (icon_name, file_name, colors, size)
+
+    surface = _surfaces.get(key)
+    if surface is not None:
+        _keys.remove(key)
+        _keys.insert(0, key)
+        return surface
+
+    surface = icon.get_surface(icon_name=icon_name, file_name=file_name,
+                               stroke_color=colors[0], fill_color=colors[1],
+                               width=size, height=size)
+    if surface is None:
+        return None
+
+    _surfaces[key] = surface
+    _keys.insert(0, key)
+    for old_key in _keys[CACHE_SIZE:]:
+        del _surfaces[old_key]
+    del _keys[CACHE_SIZE:]
+    return surface
+
+
+def paint(canvas_icon, cr, icon_name=None, file_name=None, xo_color=None):
+    """Paint a CanvasIcon from a cached surface, centered in the item
+
+    Returns False when the icon cannot be rendered, the caller then has
+    to paint it the usual way.
+    """
+    size = canvas_icon.props.size
+    if size is None:
+        return False
+    surface = get_surface(icon_name, file_name, xo_color, size)
+    if surface is None:
+        return False
+
+    width, height = canvas_icon.get_allocation()
+    cr.set_source_surface(surface, (width - surface.get_width()) / 2,
+                          (height - surface.get_height()) / 2)
+    cr.paint_with_alpha(canvas_icon.alpha)
+    return True
@@ -24,14 +24,81 @@ from sugar import wm
 from sugar.graphics import style
 
 from jarabe.model import shell
-from jarabe.view.pulsingicon import PulsingIcon
+from jarabe.view import pulsingicon
+
+
+_ZOOM_STEPS = 10
+
+_spare_windows = []
+
+
+class _PulsingImage(gtk.DrawingArea):
+    """Plays the pulse frames of an icon, see pulsingicon._get_frames()"""
+
+    def __init__(self):
+        gtk.DrawingArea.__init__(self)
+        # The drawing area has a window of its own, cleared with this
+        self.modify_bg(gtk.STATE_NORMAL, style.COLOR_WHITE.get_gdk_color())
+        self._frames = None
+        self._frame = 0
+        self._zoom_step = 0
+        self._pulse_sid = None
+        self.connect('expose-event', self.__expose_event_cb)
+
+    def set_frames(self, frames):
+        self._frames = frames
+        self._frame = 0
+        self._zoom_step = 0
+        self.queue_draw()
+
+    def set_pulsing(self, pulsing):
+        if pulsing and self._pulse_sid is None:
+            self._pulse_sid = gobject.timeout_add(pulsingicon._INTERVAL,
+                                                  self.__pulse_cb)
+        elif not pulsing and self._pulse_sid is not None:
+            gobject.source_remove(self._pulse_sid)
+            self._pulse_sid = None
+
+    def __pulse_cb(self):
+        self._frame = (self._frame + 1) % pulsingicon._PHASES_COUNT
+        if self._zoom_step < _ZOOM_STEPS:
+            self._zoom_step += 1
+        self.queue_draw()
+        return True
+
+    def __expose_event_cb(self, widget, event):
+        if not self._frames:
+            return False
+
+        phases_count = pulsingicon._PHASES_COUNT
+        frame = self._frames[min(self._frame, phases_count - self._frame)]
+        start_scale = float(style.SMALL_ICON_SIZE) / style.XLARGE_ICON_SIZE
+        scale = start_scale + \
+                (1 - start_scale) * self._zoom_step / _ZOOM_STEPS
+
+        allocation = self.get_allocation()
+        size = frame.get_width() * scale
+        cr = self.window.cairo_create()
+        cr.translate((allocation.width - size) / 2,
+                     (allocation.height - size) / 2)
+        cr.scale(scale, scale)
+        cr.set_source_surface(frame, 0, 0)
+        cr.paint()
+        return False
 
 
 class LaunchWindow(gtk.Window):
+    """Window shown while an activity starts
 
-    def __init__(self, activity_id, icon_path, icon_color):
+    Windows are reused from one launch to the next, see add_launcher().
+    """
+
+    def __init__(self):
         gobject.GObject.__init__(self)
 
+        self._activity_id = None
+        self._cancel_hid = None
+
         self.props.type_hint = gtk.gdk.WINDOW_TYPE_HINT_NORMAL
         self.props.decorated = False
         self.modify_bg(gtk.STATE_NORMAL, style.COLOR_WHITE.get_gdk_color())
@@ -47,14 +114,7 @@ class LaunchWindow(gtk.Window):
         header.show()
         canvas.pack_start(header, expand=False)
 
-        self._activity_id = activity_id
-
-        self._activity_icon = PulsingIcon(file=icon_path,
-                                          pixel_size=style.XLARGE_ICON_SIZE)
-        self._activity_icon.set_base_color(icon_color)
-        self._activity_icon.set_zooming(style.SMALL_ICON_SIZE,
-                                        style.XLARGE_ICON_SIZE, 10)
-        self._activity_icon.set_pulsing(True)
+        self._activity_icon = _PulsingImage()
         self._activity_icon.show()
         canvas.pack_start(self._activity_icon)
 
@@ -82,13 +142,41 @@ class LaunchWindow(gtk.Window):
         self._home.connect('active-activity-changed',
                            self.__active_activity_changed_cb)
 
-        self.connect('destroy', self.__destroy_cb)
-
         self._update_size()
 
+    def set_activity(self, activity_id, icon_path, icon_color):
+        """Prepare the window for the launch of another activity"""
+        self._activity_id = activity_id
+        self._activity_icon.set_frames(pulsingicon._get_frames(
+                None, icon_path, icon_color, style.XLARGE_ICON_SIZE))
+        self.error_text.hide()
+        self.cancel_button.hide()
+        if self._cancel_hid is not None:
+            self.cancel_button.disconnect(self._cancel_hid)
+            self._cancel_hid = None
+        if self.window is not None:
+            wm.set_activity_id(self.window, str(self._activity_id))
+
+    def show_error(self, home_activity):
+        self.error_text.props.label = _('<b>%s</b> failed to start.') % \
+                home_activity.get_activity_name()
+        self.error_text.show()
+
+        self._cancel_hid = self.cancel_button.connect('clicked',
+                self.__cancel_button_clicked_cb, home_activity)
+        self.cancel_button.show()
+
+    def __cancel_button_clicked_cb(self, button, home_activity):
+        _destroy_launcher(home_activity)
+
     def show(self):
+        self._activity_icon.set_pulsing(True)
         self.present()
 
+    def hide(self):
+        self._activity_icon.set_pulsing(False)
+        gtk.Window.hide(self)
+
     def _update_size(self):
         self.resize(gtk.gdk.screen_width(), gtk.gdk.screen_height())
 
@@ -101,14 +189,11 @@ class LaunchWindow(gtk.Window):
         self._update_size()
 
     def __active_activity_changed_cb(self, model, activity):
-        if activity.get_activity_id() == self._activity_id:
-            self._activity_icon.props.paused = False
-        else:
-            self._activity_icon.props.paused = True
-
-    def __destroy_cb(self, box):
-        self._activity_icon.props.pulsing = False
-        self._home.disconnect_by_func(self.__active_activity_changed_cb)
+        if not self.props.visible:
+            return
+        self._activity_icon.set_pulsing(
+                activity is not None and
+                activity.get_activity_id() == self._activity_id)
 
 
 def setup():
@@ -124,7 +209,11 @@ def add_launcher(activity_id, icon_path, icon_color):
     if model.get_launcher(activity_id) is not None:
         return
 
-    launch_window = LaunchWindow(activity_id, icon_path, icon_color)
+    if _spare_windows:
+        launch_window = _spare_windows.pop()
+    else:
+        launch_window = LaunchWindow()
+    launch_window.set_activity(activity_id, icon_path, icon_color)
     launch_window.show()
 
     model.register_launcher(activity_id, launch_window)
@@ -142,17 +231,7 @@ def __launch_failed_cb(home_model, home_activity):
     if launcher is None:
         logging.error('Launcher for %s is missing', activity_id)
     else:
-        launcher.error_text.props.label = _('<b>%s</b> failed to start.') % \
-                home_activity.get_activity_name()
-        launcher.error_text.show()
-
-        launcher.cancel_button.connect('clicked',
-                __cancel_button_clicked_cb, home_activity)
-        launcher.cancel_button.show()
-
-
-def __cancel_button_clicked_cb(button, home_activity):
-    _destroy_launcher(home_activity)
+        launcher.show_error(home_activity)
 
 
 def __launch_completed_cb(home_model, home_activity):
@@ -169,4 +248,5 @@ def _destroy_launcher(home_activity):
         return
 
     shell.get_model().unregister_launcher(activity_id)
-    launcher.destroy()
+    launcher.hide()
+    _spare_windows.append(launcher)
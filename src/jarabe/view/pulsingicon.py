@@ -15,20 +15,86 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 import math
+from collections import deque
 
 import gobject
+import gtk
+import cairo
 
-from sugar.graphics.icon import Icon, CanvasIcon
+from sugar.graphics.icon import Icon, CanvasIcon, get_surface
 from sugar.graphics import style
 
 _INTERVAL = 100
 _STEP = math.pi / 10  # must be a fraction of pi, for clean caching
 _MINIMAL_ALPHA_VALUE = 0.33
 
+# Phases in a pulse, the second half repeats the first one backwards
+_PHASES_COUNT = int(round(2 * math.pi / _STEP))
+
+# Number of (icon, color, size) whose frames are kept
+_FRAMES_CACHE_SIZE = 16
+
+_frames_cache = []
+
+# Number of pulses animated at the same time in a view, the others wait
+# for a slot
+_MAX_RUNNING_PULSERS = 8
+
+# Pulsers by the widget they are painted in, see Pulser._get_widget(),
+# so that a crowded view does not hold back the frame or the launcher
+_running_pulsers = {}
+_waiting_pulsers = {}
+
+
+def _get_frames(icon_name, file_name, xo_color, size):
+    """Return the frames of a pulse, rendering them if needed"""
+    key = (icon_name, file_name, xo_color.to_string(), size)
+    for i, (frames_key, frames) in enumerate(_frames_cache):
+        if frames_key == key:
+            del _frames_cache[i]
+            _frames_cache.insert(0, (key, frames))
+            return frames
+
+    surface = get_surface(icon_name=icon_name, file_name=file_name,
+                          fill_color=xo_color.get_fill_color(),
+                          stroke_color=xo_color.get_stroke_color(),
+                          width=size, height=size)
+    if surface is None:
+        return None
+
+    frames = []
+    for phase in range(_PHASES_COUNT / 2 + 1):
+        frame = cairo.ImageSurface(cairo.FORMAT_ARGB32, surface.get_width(),
+                                   surface.get_height())
+        cr = cairo.Context(frame)
+        cr.set_source_surface(surface, 0, 0)
+        cr.paint_with_alpha(_get_alpha(phase))
+        frames.append(frame)
+
+    _frames_cache.insert(0, (key, frames))
+    del _frames_cache[_FRAMES_CACHE_SIZE:]
+    return frames
+
+
+def _get_alpha(phase):
+    return _MINIMAL_ALPHA_VALUE + \
+            (1 - _MINIMAL_ALPHA_VALUE) * (math.cos(phase * _STEP) + 1) / 2
+
 
 class Pulser(object):
+    """Animate an icon, cycling through pre-rendered frames
+
+    The icon provides _get_frames() and _set_pulse_frame(), see
+    PulsingIcon. The animation waits while the icon is not mapped, and
+    while _MAX_RUNNING_PULSERS other icons of the same widget are pulsing.
+    """
+
     def __init__(self, icon):
         self._pulse_hid = None
+        self._map_hid = None
+        self._mapped_widget = None
+        # widget where the pulser runs or waits for a slot
+        self._view = None
         self._icon = icon
         self._phase = 0
         self._start_scale = 1.0
@@ -49,8 +115,16 @@ class Pulser(object):
     def start(self, restart=False):
         if restart:
             self._phase = 0
-        if self._pulse_hid is None:
-            self._pulse_hid = gobject.timeout_add(_INTERVAL, self.__pulse_cb)
+        if self._pulse_hid is None and self._map_hid is None and \
+                self._view is None:
+            self._view = self._get_widget()
+            running = _running_pulsers.setdefault(self._view, set())
+            if len(running) < _MAX_RUNNING_PULSERS:
+                running.add(self)
+                self._pulse_hid = gobject.timeout_add(_INTERVAL,
+                                                      self.__pulse_cb)
+            else:
+                _waiting_pulsers.setdefault(self._view, deque()).append(self)
         if self._start_scale != self._end_scale:
             self._icon.scale = self._start_scale + \
                     self._current_scale_step * self._current_zoom_step
@@ -59,25 +133,89 @@ class Pulser(object):
         if self._pulse_hid is not None:
             gobject.source_remove(self._pulse_hid)
             self._pulse_hid = None
+            self._release()
+        elif self._view is not None:
+            waiting = _waiting_pulsers[self._view]
+            waiting.remove(self)
+            if not waiting:
+                del _waiting_pulsers[self._view]
+            if not _running_pulsers.get(self._view):
+                _running_pulsers.pop(self._view, None)
+            self._view = None
+        if self._map_hid is not None:
+            self._mapped_widget.disconnect(self._map_hid)
+            self._map_hid = None
+            self._mapped_widget = None
+        self._icon._set_pulse_frame(None)
         self._icon.xo_color = self._icon.get_base_color()
         self._phase = 0
         self._icon.alpha = 1.0
 
+    def _release(self):
+        view = self._view
+        self._view = None
+        running = _running_pulsers[view]
+        running.discard(self)
+        waiting = _waiting_pulsers.get(view)
+        while waiting and len(running) < _MAX_RUNNING_PULSERS:
+            pulser = waiting.popleft()
+            pulser._view = None
+            pulser.start()
+        if not waiting:
+            _waiting_pulsers.pop(view, None)
+        if not running:
+            _running_pulsers.pop(view, None)
+
     def update(self):
-        self._icon.xo_color = self._icon.base_color
-        self._icon.alpha = _MINIMAL_ALPHA_VALUE + \
-                (1 - _MINIMAL_ALPHA_VALUE) * (math.cos(self._phase) + 1) / 2
+        frames = None
+        if self._pulse_hid is not None and not self._is_zooming():
+            frames = self._icon._get_frames()
+
+        if frames is not None:
+            phase = self._phase % _PHASES_COUNT
+            self._icon._set_pulse_frame(
+                    frames[min(phase, _PHASES_COUNT - phase)])
+        else:
+            self._icon._set_pulse_frame(None)
+            self._icon.xo_color = self._icon.base_color
+            self._icon.alpha = _get_alpha(self._phase)
+
+    def _is_zooming(self):
+        return self._start_scale != self._end_scale and \
+                self._current_zoom_step <= self._zoom_steps
+
+    def _get_widget(self):
+        if isinstance(self._icon, gtk.Widget):
+            return self._icon
+        context = self._icon.get_context()
+        if isinstance(context, gtk.Widget):
+            return context
+        return None
 
     def __pulse_cb(self):
-        self._phase += _STEP
-        if self._current_zoom_step <= self._zoom_steps and \
-            self._start_scale != self._end_scale:
+        widget = self._get_widget()
+        if widget is not None and not widget.flags() & gtk.MAPPED:
+            # Nobody can see the icon, wait for it to be shown again
+            self._pulse_hid = None
+            self._mapped_widget = widget
+            self._map_hid = widget.connect('map', self.__map_cb)
+            self._release()
+            return False
+
+        self._phase += 1
+        if self._is_zooming():
             self._icon.scale = self._start_scale + \
                     self._current_scale_step * self._current_zoom_step
             self._current_zoom_step += 1
         self.update()
         return True
 
+    def __map_cb(self, widget):
+        widget.disconnect(self._map_hid)
+        self._map_hid = None
+        self._mapped_widget = None
+        self.start()
+
 
 class PulsingIcon(Icon):
     __gtype_name__ = 'SugarPulsingIcon'
@@ -88,6 +226,7 @@ class PulsingIcon(Icon):
         self._pulse_color = None
         self._paused = False
         self._pulsing = False
+        self._pulse_frame = None
 
         Icon.__init__(self, **kwargs)
 
@@ -163,6 +302,39 @@ class PulsingIcon(Icon):
 
     palette = property(_get_palette, _set_palette)
 
+    def _get_frames(self):
+        if self._base_color is None:
+            return None
+        if self.props.pixel_size > 0:
+            size = self.props.pixel_size
+        else:
+            size = gtk.icon_size_lookup(self.props.icon_size)[0]
+        if size <= 0:
+            return None
+        return _get_frames(self.props.icon_name, self.props.file,
+                           self._base_color, size)
+
+    def _set_pulse_frame(self, frame):
+        if frame is not self._pulse_frame:
+            self._pulse_frame = frame
+            self.queue_draw()
+
+    def do_expose_event(self, event):
+        if self._pulse_frame is None:
+            return Icon.do_expose_event(self, event)
+
+        allocation = self.get_allocation()
+        x = allocation.x + (allocation.width -
+                            self._pulse_frame.get_width()) / 2
+        y = allocation.y + (allocation.height -
+                            self._pulse_frame.get_height()) / 2
+        cr = self.window.cairo_create()
+        cr.rectangle(event.area)
+        cr.clip()
+        cr.set_source_surface(self._pulse_frame, x, y)
+        cr.paint()
+        return False
+
     def __destroy_cb(self, icon):
         self._pulser.stop()
         if self._palette is not None:
@@ -178,6 +350,7 @@ class CanvasPulsingIcon(CanvasIcon):
         self._pulse_color = None
         self._paused = False
         self._pulsing = False
+        self._pulse_frame = None
 
         CanvasIcon.__init__(self, **kwargs)
 
@@ -186,6 +359,28 @@ class CanvasPulsingIcon(CanvasIcon):
     def __destroy_cb(self, box):
         self._pulser.stop()
 
+    def _get_frames(self):
+        if self._base_color is None or self.props.size is None:
+            return None
+        return _get_frames(self.props.icon_name, self.props.file_name,
+                           self._base_color, self.props.size)
+
+    def _set_pulse_frame(self, frame):
+        if frame is not self._pulse_frame:
+            self._pulse_frame = frame
+            self.emit_paint_needed(0, 0, -1, -1)
+
+    def do_paint_below_children(self, cr, damaged_box):
+        if self._pulse_frame is None:
+            CanvasIcon.do_paint_below_children(self, cr, damaged_box)
+            return
+
+        width, height = self.get_allocation()
+        cr.set_source_surface(self._pulse_frame,
+                (width - self._pulse_frame.get_width()) / 2,
+                (height - self._pulse_frame.get_height()) / 2)
+        cr.paint()
+
     def set_pulse_color(self, pulse_color):
         self._pulse_color = pulse_color
         self._pulser.update()
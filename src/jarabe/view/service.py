@@ -88,3 +88,11 @@ class UIService(dbus.service.Object):
                          in_signature='s', out_signature='')
     def NotifyLaunchFailure(self, activity_id):
         shell.get_model().notify_launch_failed(activity_id)
+
+    @dbus.service.method(_DBUS_SHELL_IFACE,
+                         in_signature='', out_signature='aa{sv}')
+    def GetLaunchTimings(self):
+        """Return the timings of the last activity launches, see
+        ShellModel.get_launch_timings()
+        """
+        return shell.get_model().get_launch_timings()